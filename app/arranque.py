@@ -0,0 +1,120 @@
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from app.catalogo import EXCEL_PATH, obtener_catalogo
+
+
+class EstadoArranque:
+    """Fases del arranque ya completadas y su duración; /readyz responde según 'listo'."""
+
+    def __init__(self):
+        self.listo = False
+        self.fases = {}
+        self.error = None
+        self.inicio = time.perf_counter()
+
+    def to_dict(self):
+        return {
+            "listo": self.listo,
+            "fases_ms": self.fases,
+            "total_ms": round(sum(self.fases.values()), 1),
+            "error": self.error,
+        }
+
+
+estado = EstadoArranque()
+
+
+@contextmanager
+def _fase(nombre):
+    inicio = time.perf_counter()
+    yield
+    ms = round((time.perf_counter() - inicio) * 1000, 1)
+    estado.fases[nombre] = ms
+    print(f"⏱️ Arranque · {nombre}: {ms} ms")
+
+
+def precargar_esquema():
+    """Catálogo de preguntas, columnas editables y configuración de los mappers de SQLAlchemy."""
+    from app import models  # noqa: F401  (registra los modelos antes de configurar)
+    from app.excel_utils import columnas_editables
+
+    configure_mappers()
+    try:
+        obtener_catalogo(EXCEL_PATH)
+        columnas_editables()
+    except Exception as e:
+        # Sin Excel la aplicación funciona igual (la BD es la fuente de la verdad)
+        print(f"⚠️ No se pudo precargar el catálogo de preguntas: {e}")
+
+
+def compilar_plantillas(*plantillas):
+    """Compila todas las plantillas Jinja2 para que la primera petición no lo haga."""
+    total = 0
+    for templates in plantillas:
+        for nombre in templates.env.list_templates():
+            templates.env.get_template(nombre)
+            total += 1
+    return total
+
+
+def preparar_bd(engine, session_factory):
+    """Abre la primera conexión del pool, la valida y deja el esquema al día."""
+    from app.busqueda import crear_indice, reconstruir_indice
+    from app.database import Base, anadir_columnas_nuevas
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    # Crear las tablas nuevas si la base de datos es anterior a ellas
+    # y añadir las columnas nuevas (p. ej. 'version') a las tablas que ya existían
+    Base.metadata.create_all(bind=engine)
+    anadir_columnas_nuevas(engine)
+
+    # El índice de búsqueda se llena la primera vez; después se mantiene en cada guardado
+    if crear_indice(engine):
+        with session_factory() as db:
+            reconstruir_indice(db)
+            db.commit()
+
+
+def precalcular_graficos():
+    """
+    Figuras por defecto de todas las preguntas en la caché de gráficos, para que la API
+    las sirva ya hechas. Se hace con la aplicación ya lista: un fallo aquí no la para.
+    """
+    from app.dataset import obtener_dataset
+    from app.graficos import cache_graficos
+
+    try:
+        with _fase("gráficos"):
+            total = cache_graficos.precalcular(obtener_dataset(EXCEL_PATH), obtener_catalogo(EXCEL_PATH))
+        print(f"📊 {total} figuras preparadas en la caché de gráficos.")
+    except Exception as e:
+        print(f"⚠️ No se pudieron preparar las figuras: {e}")
+
+
+def arrancar(engine, session_factory, *plantillas):
+    """
+    Ejecuta las fases del arranque en orden y mide cada una.
+    Si alguna falla, la aplicación sigue viva (/healthz) pero no lista (/readyz = 503).
+    """
+    try:
+        with _fase("esquema"):
+            precargar_esquema()
+        with _fase("plantillas"):
+            compilar_plantillas(*plantillas)
+        with _fase("base de datos"):
+            preparar_bd(engine, session_factory)
+    except Exception as e:
+        estado.error = f"{e.__class__.__name__}: {e}"
+        print(f"❌ Arranque incompleto: {estado.error}")
+        return estado
+
+    estado.listo = True
+    total = round((time.perf_counter() - estado.inicio) * 1000, 1)
+    print(f"🚀 Aplicación lista en {total} ms (desde la importación)")
+    return estado
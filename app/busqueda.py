@@ -0,0 +1,178 @@
+import json
+import re
+
+from sqlalchemy import text
+
+from app.catalogo import EXCEL_PATH, TEXTO, obtener_catalogo
+
+# -----------------------------------------------------
+# Índice de búsqueda de texto completo (SQLite FTS5)
+# -----------------------------------------------------
+# Un documento por municipio y campo: las notas y cada respuesta de texto libre.
+# 'remove_diacritics 2' hace que "informática" y "informatica" sean el mismo término.
+TABLA = "busqueda_fts"
+CAMPO_NOTAS = "notas"
+
+# Cada municipio tiene reservado un bloque de rowids: borrar sus documentos es un
+# rango de rowid (no hace falta recorrer la tabla entera).
+_BLOQUE = 10000
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def crear_indice(bind):
+    """Crea la tabla FTS5 si no existe. Devuelve True si se acaba de crear (hay que llenarla)."""
+    with bind.begin() as conn:
+        existe = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :nombre"),
+            {"nombre": TABLA},
+        ).first()
+        if existe:
+            return False
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {TABLA} USING fts5("
+            "ayto_id UNINDEXED, campo UNINDEXED, texto, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+    print(f"🔎 Índice de búsqueda creado ({TABLA}).")
+    return True
+
+
+def _columnas_texto():
+    """Columnas de respuesta libre según el catálogo (None = indexar cualquier texto)."""
+    try:
+        return set(obtener_catalogo(EXCEL_PATH).columnas(TEXTO))
+    except Exception as e:
+        print(f"⚠️ Sin catálogo para el índice de búsqueda, se indexa todo el texto: {e}")
+        return None
+
+
+def _documentos(respuestas, notas, columnas):
+    documentos = []
+    if notas and notas.strip():
+        documentos.append((CAMPO_NOTAS, notas.strip()))
+    for campo, valor in respuestas.items():
+        if columnas is not None and campo not in columnas:
+            continue
+        if isinstance(valor, str) and valor.strip() and not valor.strip().isdigit():
+            documentos.append((campo, valor.strip()))
+    return documentos[:_BLOQUE]
+
+
+def indexar_municipio(db, ayto_id, respuestas, notas=None, columnas=None):
+    """
+    Sustituye los documentos de un municipio. No hace commit: va en la misma
+    transacción que el guardado de las respuestas.
+    """
+    columnas = _columnas_texto() if columnas is None else columnas
+    inicio = ayto_id * _BLOQUE
+    db.execute(
+        text(f"DELETE FROM {TABLA} WHERE rowid BETWEEN :inicio AND :fin"),
+        {"inicio": inicio, "fin": inicio + _BLOQUE - 1},
+    )
+    filas = [
+        {"rowid": inicio + i, "ayto_id": ayto_id, "campo": campo, "texto": texto}
+        for i, (campo, texto) in enumerate(_documentos(respuestas, notas, columnas))
+    ]
+    if filas:
+        db.execute(
+            text(f"INSERT INTO {TABLA} (rowid, ayto_id, campo, texto) VALUES (:rowid, :ayto_id, :campo, :texto)"),
+            filas,
+        )
+    return len(filas)
+
+
+def reconstruir_indice(db):
+    """Vuelve a indexar todos los municipios (tras una sincronización completa). No hace commit."""
+    from app.models import DatosAyuntamiento
+
+    columnas = _columnas_texto()
+    db.execute(text(f"DELETE FROM {TABLA}"))
+    total = 0
+    for ayto_id, data_json, notas in db.query(
+        DatosAyuntamiento.ayto_id, DatosAyuntamiento.data_json, DatosAyuntamiento.notas
+    ):
+        try:
+            respuestas = json.loads(data_json) if data_json else {}
+        except Exception:
+            respuestas = {}
+        total += indexar_municipio(db, ayto_id, respuestas, notas, columnas)
+    db.execute(text(f"INSERT INTO {TABLA}({TABLA}) VALUES ('optimize')"))
+    print(f"🔎 Índice de búsqueda reconstruido: {total} documentos.")
+    return total
+
+
+def consulta_fts(q):
+    """
+    Convierte el texto del usuario en una consulta FTS5 segura: cada palabra entre
+    comillas (sin operadores ni sintaxis) y la última como prefijo, para buscar mientras se escribe.
+    """
+    tokens = _TOKEN.findall(q or "")
+    if not tokens:
+        return None
+    partes = [f'"{t}"' for t in tokens]
+    partes[-1] += "*"
+    return " ".join(partes)
+
+
+def buscar(db, q, pagina=1, por_pagina=20):
+    """Resultados ordenados por relevancia (bm25) con un fragmento del texto encontrado."""
+    consulta = consulta_fts(q)
+    if consulta is None:
+        return {"q": q, "total": 0, "pagina": pagina, "por_pagina": por_pagina, "resultados": []}
+
+    total = db.execute(
+        text(f"SELECT count(*) FROM {TABLA} WHERE {TABLA} MATCH :q"), {"q": consulta}
+    ).scalar()
+    filas = db.execute(
+        text(
+            f"SELECT a.codigo, a.nombre, {TABLA}.campo, "
+            f"snippet({TABLA}, 2, '<mark>', '</mark>', '…', 12) AS fragmento, "
+            f"bm25({TABLA}) AS puntuacion "
+            f"FROM {TABLA} JOIN ayuntamientos a ON a.id = {TABLA}.ayto_id "
+            f"WHERE {TABLA} MATCH :q ORDER BY puntuacion LIMIT :limite OFFSET :desplazamiento"
+        ),
+        {"q": consulta, "limite": por_pagina, "desplazamiento": (pagina - 1) * por_pagina},
+    ).all()
+
+    return {
+        "q": q,
+        "total": total,
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "resultados": [
+            {
+                "municipio": {"codigo": codigo, "nombre": nombre},
+                "campo": campo,
+                "fragmento": fragmento,
+                "puntuacion": round(-puntuacion, 4),  # bm25 es negativo: más negativo = más relevante
+            }
+            for codigo, nombre, campo, fragmento, puntuacion in filas
+        ],
+    }
+
+
+def buscar_en_regiones(q, pagina=1, por_pagina=20, router=None):
+    """
+    La misma búsqueda en la base de datos de cada región a la vez. Cada región devuelve sus
+    primeros pagina*por_pagina resultados y se mezclan por relevancia.
+    """
+    from app.shards import obtener_router
+
+    router = router or obtener_router()
+    hasta = pagina * por_pagina
+    por_region = router.en_paralelo(lambda region, db: buscar(db, q, 1, hasta))
+
+    resultados = [
+        {**r, "region": region}
+        for region, parcial in por_region.items()
+        for r in parcial["resultados"]
+    ]
+    resultados.sort(key=lambda r: r["puntuacion"], reverse=True)
+    return {
+        "q": q,
+        "total": sum(parcial["total"] for parcial in por_region.values()),
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "resultados": resultados[hasta - por_pagina:hasta],
+    }
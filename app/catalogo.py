@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from dataclasses import dataclass, field, asdict
+
+import pandas as pd
+
+# -----------------------------------------------------
+# CONFIGURACIÓN
+# -----------------------------------------------------
+EXCEL_PATH = "data/ENCUESTAS_datosIA.xlsx"
+CATALOGO_PATH = "data/catalogo_preguntas.json"
+MUNICIPIO_COL = "AYUNTAMIENTO"
+NIVEL_COL = "Nivel digitalización"
+PREFIJO_PONDER = "PONDER"
+
+CATEGORICA = "categorica"
+NUMERICA = "numerica"
+TEXTO = "texto"
+
+# Máximo de respuestas distintas para considerar categórica una columna sin códigos
+MAX_CATEGORIAS_SIN_CODIGO = 10
+
+# Respuestas que en las columnas de recuento equivalen a un número
+EQUIVALENTES_NUMERICOS = {"ninguna": 0, "ninguno": 0}
+
+_CODIGO_PREGUNTA = re.compile(r"^P?\s*(\d+(?:\.\s*\d+)*)", re.IGNORECASE)
+_CODIGO_RESPUESTA = re.compile(r"^\s*(\d+)\s*\.")
+_SUFIJO_PANDAS = re.compile(r"\.\d+$")  # 'Nº.1', 'P6. Formación conjunto .3'
+
+
+def codigo_pregunta(columna):
+    """Devuelve el código de la pregunta ('P8', 'P8.1'...) o None si la columna no es una pregunta."""
+    nombre = str(columna).strip()
+    if not nombre.upper().startswith("P") and not nombre[:1].isdigit():
+        return None
+    match = _CODIGO_PREGUNTA.match(nombre)
+    if not match:
+        return None
+    return "P" + re.sub(r"\s+", "", match.group(1))
+
+
+def a_numero(valor):
+    """Convierte una respuesta a número ('Ninguna' -> 0). Devuelve None si no es numérica."""
+    if valor is None:
+        return None
+    texto = str(valor).strip().lower()
+    if texto in EQUIVALENTES_NUMERICOS:
+        return float(EQUIVALENTES_NUMERICOS[texto])
+    try:
+        numero = float(texto.replace(",", "."))
+    except ValueError:
+        return None
+    return None if numero != numero else numero  # descarta NaN
+
+
+def _orden_respuesta(valor):
+    match = _CODIGO_RESPUESTA.match(valor)
+    return (int(match.group(1)) if match else 10**6, valor)
+
+
+@dataclass
+class Pregunta:
+    id: str  # identificador estable ('P8', 'P6_3', 'P3.N')
+    nombre: str  # nombre canónico (espacios normalizados, sin sufijos de pandas)
+    columna: str  # clave en los DataFrames y en data_json (cabecera sin espacios alrededor)
+    cabecera: str  # cabecera tal cual aparece en el Excel
+    tipo: str  # categorica / numerica / texto
+    grupo: str  # pregunta principal: 'P6' agrupa todas las subcolumnas de P6
+    valores: list = field(default_factory=list)  # valores permitidos (solo categóricas)
+
+
+def inferir_tipo(cabecera, serie):
+    """Deduce el tipo de una columna a partir de su cabecera y sus respuestas."""
+    if "indicar" in cabecera.lower():
+        return TEXTO
+
+    valores = [str(v).strip() for v in serie.dropna().unique()]
+    valores = [v for v in valores if v]
+    if not valores:
+        return CATEGORICA
+
+    if all(a_numero(v) is not None for v in valores) and any(a_numero(v) for v in valores):
+        return NUMERICA
+
+    # Categórica: respuestas con código ('1. Sí') o pocas respuestas distintas que se repiten
+    con_codigo = sum(1 for v in valores if _CODIGO_RESPUESTA.match(v))
+    if con_codigo >= 0.8 * len(valores):
+        return CATEGORICA
+    if len(valores) <= MAX_CATEGORIAS_SIN_CODIGO and len(valores) <= 0.3 * serie.notna().sum():
+        return CATEGORICA
+    return TEXTO
+
+
+class Catalogo:
+    """Catálogo de preguntas de una versión concreta del Excel."""
+
+    def __init__(self, version, preguntas, municipio_col=MUNICIPIO_COL, nivel_col=NIVEL_COL):
+        self.version = version
+        self.preguntas = preguntas
+        self.municipio_col = municipio_col
+        self.nivel_col = nivel_col
+        self._por_clave = {}
+        # Orden de prioridad: id > columna > nombre canónico > código (primera aparición)
+        for p in reversed(preguntas):
+            self._por_clave[codigo_pregunta(p.id).upper()] = p
+        for p in preguntas:
+            self._por_clave[p.nombre.upper()] = p
+        for p in preguntas:
+            self._por_clave[p.columna.upper()] = p
+        for p in preguntas:
+            self._por_clave[p.id.upper()] = p
+
+    def pregunta(self, clave):
+        """Busca una pregunta por id, columna, nombre canónico o código. None si no existe."""
+        return self._por_clave.get(str(clave).strip().upper())
+
+    def columnas(self, tipo=None, incluir_recuentos=True):
+        return [
+            p.columna for p in self.preguntas
+            if (tipo is None or p.tipo == tipo) and (incluir_recuentos or not p.id.endswith(".N"))
+        ]
+
+    def tipos(self):
+        return {p.columna: p.tipo for p in self.preguntas}
+
+    def grupos(self):
+        grupos = {}
+        for p in self.preguntas:
+            grupos.setdefault(p.grupo, []).append(p.columna)
+        return grupos
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "municipio_col": self.municipio_col,
+            "nivel_col": self.nivel_col,
+            "preguntas": [asdict(p) for p in self.preguntas],
+        }
+
+    @classmethod
+    def from_dict(cls, datos):
+        return cls(
+            datos["version"],
+            [Pregunta(**p) for p in datos["preguntas"]],
+            datos.get("municipio_col", MUNICIPIO_COL),
+            datos.get("nivel_col", NIVEL_COL),
+        )
+
+
+def version_excel(path):
+    """Huella SHA-256 del fichero: identifica la versión del Excel."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def compilar_catalogo(df, cabeceras=None, version=None):
+    """
+    Construye el catálogo a partir de un DataFrame del Excel.
+    'cabeceras' son las cabeceras originales (sin los sufijos .1, .2 que añade pandas a las repetidas).
+    """
+    cabeceras = cabeceras or [str(c) for c in df.columns]
+    preguntas, ids = [], set()
+    repeticiones = {}
+    anterior = None
+
+    for label, cabecera in zip(df.columns, cabeceras):
+        columna = str(label).strip()
+        nombre = re.sub(r"\s+", " ", str(cabecera)).strip()
+        if columna in (MUNICIPIO_COL, NIVEL_COL) or columna.upper().startswith(PREFIJO_PONDER):
+            continue
+
+        codigo = codigo_pregunta(nombre)
+        if codigo is None and _SUFIJO_PANDAS.sub("", nombre) == "Nº" and anterior is not None:
+            # Columna de recuento asociada a la pregunta anterior (P3, P4, P5)
+            codigo = anterior.id + ".N"
+            nombre = f"{anterior.nombre} (Nº)"
+            grupo = anterior.grupo
+        elif codigo is None:
+            continue
+        else:
+            grupo = codigo.split(".")[0]
+
+        # Las cabeceras repetidas (P6, P7) se numeran: 'P6. Formación conjunto (2)'
+        repeticiones[nombre] = repeticiones.get(nombre, 0) + 1
+        if repeticiones[nombre] > 1:
+            nombre = f"{nombre} ({repeticiones[nombre]})"
+
+        id_pregunta, n = codigo, 0
+        while id_pregunta in ids:
+            n += 1
+            id_pregunta = f"{codigo}_{n}"
+        ids.add(id_pregunta)
+
+        tipo = inferir_tipo(nombre, df[label])
+        valores = []
+        if tipo == CATEGORICA:
+            distintos = {str(v).strip() for v in df[label].dropna().unique()} - {""}
+            valores = sorted(distintos, key=_orden_respuesta)
+
+        pregunta = Pregunta(id_pregunta, nombre, columna, str(cabecera), tipo, grupo, valores)
+        preguntas.append(pregunta)
+        if not pregunta.id.endswith(".N"):
+            anterior = pregunta
+
+    return Catalogo(version, preguntas)
+
+
+def _leer_y_compilar(path, version):
+    df = pd.read_excel(path, engine="openpyxl")
+    # Cabeceras originales: pandas renombra las repetidas ('P6. Formación conjunto .1')
+    cabeceras = pd.read_excel(path, engine="openpyxl", header=None, nrows=1).iloc[0].tolist()
+    return compilar_catalogo(df, [str(c) for c in cabeceras], version)
+
+
+# El catálogo se compila una vez por versión del Excel y se guarda en CATALOGO_PATH
+_cache = {}
+_lock = threading.Lock()
+
+
+def obtener_catalogo(path=EXCEL_PATH, catalogo_path=CATALOGO_PATH):
+    estado = os.stat(path)
+    clave = (path, estado.st_mtime_ns, estado.st_size)
+    with _lock:
+        if clave in _cache:
+            return _cache[clave]
+
+        version = version_excel(path)
+        catalogo = None
+        if os.path.exists(catalogo_path):
+            try:
+                with open(catalogo_path, encoding="utf-8") as f:
+                    guardado = json.load(f)
+                if guardado.get("version") == version:
+                    catalogo = Catalogo.from_dict(guardado)
+            except Exception as e:
+                print(f"⚠️ Catálogo guardado no válido, se vuelve a compilar: {e}")
+
+        if catalogo is None:
+            catalogo = _leer_y_compilar(path, version)
+            _guardar_json(catalogo, catalogo_path)
+            print(f"📚 Catálogo compilado: {len(catalogo.preguntas)} preguntas (versión {version[:8]}).")
+
+        # Solo se guarda la versión actual de cada Excel: las anteriores ya no se van a pedir
+        for anterior in [c for c in _cache if c[0] == path]:
+            del _cache[anterior]
+        _cache[clave] = catalogo
+        return catalogo
+
+
+def _guardar_json(catalogo, catalogo_path):
+    # Fichero temporal del mismo directorio y os.replace: otro proceso que lea el catálogo
+    # a la vez ve el anterior o el nuevo, nunca uno a medio escribir
+    fd, temporal = tempfile.mkstemp(suffix=".json", dir=os.path.dirname(catalogo_path) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(catalogo.to_dict(), f, ensure_ascii=False, indent=1)
+        os.replace(temporal, catalogo_path)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
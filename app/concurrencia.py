@@ -0,0 +1,170 @@
+import json
+import os
+import tempfile
+import threading
+
+import pandas as pd
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.busqueda import indexar_municipio
+from app.historial import compactar, registrar_cambios
+from app.models import CambioRespuesta, DatosAyuntamiento
+
+# Veces que se repite un guardado cuando otro usuario ha escrito a la vez
+MAX_REINTENTOS = 3
+
+
+class ConflictoEdicion(Exception):
+    """
+    Otro usuario ha cambiado las mismas preguntas desde que se cargó el formulario.
+    'conflictos' es una lista de {pregunta, tuyo, actual, autor}.
+    """
+
+    def __init__(self, mensaje, conflictos=(), version_actual=None):
+        super().__init__(mensaje)
+        self.conflictos = list(conflictos)
+        self.version_actual = version_actual
+
+
+def _cargar(data_json):
+    try:
+        return json.loads(data_json) if data_json else {}
+    except Exception:
+        return {}
+
+
+def _conflictos(db, datos, actuales, nuevos, version_base):
+    """
+    Preguntas que otro guardado ha cambiado después de 'version_base' y a las que ahora
+    se les quiere dar un valor distinto del que tienen. Si el valor coincide no hay conflicto.
+    """
+    if version_base is None or datos.version == version_base:
+        return []
+
+    cambios = (
+        db.query(CambioRespuesta)
+        .filter(
+            CambioRespuesta.ayto_id == datos.ayto_id,
+            CambioRespuesta.version > version_base,
+            CambioRespuesta.pregunta.in_(list(nuevos)),
+        )
+        .order_by(CambioRespuesta.id)
+    )
+    ultimo_autor = {c.pregunta: c.autor for c in cambios}
+    return [
+        {"pregunta": p, "tuyo": nuevos[p], "actual": actuales.get(p), "autor": autor}
+        for p, autor in ultimo_autor.items()
+        if actuales.get(p) != nuevos[p]
+    ]
+
+
+def guardar_respuestas(db, ayto, nuevos, version_base=None, autor=None, calcular_nivel=None):
+    """
+    Guarda las respuestas 'nuevos' ({pregunta: valor}) de un municipio con control optimista.
+
+    1. Se relee la fila; si su versión ya no es 'version_base', se comprueba qué preguntas
+       han cambiado desde entonces. Si alguna coincide con las enviadas y el valor es distinto,
+       se lanza ConflictoEdicion. Las demás se fusionan con lo que ya hay.
+    2. El índice de búsqueda del municipio se actualiza en la misma transacción.
+    3. El UPDATE lleva 'WHERE version = ?': si otro guardado se cuela entre la lectura y el
+       commit (StaleDataError) se deshace la transacción y se repite desde el paso 1.
+
+    'calcular_nivel(respuestas)' devuelve el nivel a guardar (None para no tocarlo).
+    Devuelve (datos, respuestas, nivel, version_subida) ya confirmados en la BD;
+    'version_subida' es False si el guardado no cambiaba nada (la fila no se ha tocado).
+    """
+    for intento in range(1, MAX_REINTENTOS + 1):
+        try:
+            datos = (
+                db.query(DatosAyuntamiento)
+                .filter_by(ayto_id=ayto.id)
+                .populate_existing()
+                .first()
+            )
+            if not datos:
+                datos = DatosAyuntamiento(ayto_id=ayto.id, data_json="{}")
+                db.add(datos)
+                db.flush()
+
+            actuales = _cargar(datos.data_json)
+            conflictos = _conflictos(db, datos, actuales, nuevos, version_base)
+            if conflictos:
+                raise ConflictoEdicion(
+                    "Otro usuario ha modificado: " + ", ".join(c["pregunta"] for c in conflictos),
+                    conflictos,
+                    datos.version,
+                )
+
+            # Todos los cambios de la fila antes del flush: un guardado es un solo UPDATE
+            # y la versión sube una sola vez
+            version_anterior = datos.version
+            respuestas = {**actuales, **nuevos}
+            datos.data_json = json.dumps(respuestas, ensure_ascii=False)
+            nivel = calcular_nivel(respuestas) if calcular_nivel else None
+            if nivel is not None:
+                datos.nivel_digitalizacion = nivel
+                ayto.nivel_digitalizacion = nivel
+            db.flush()
+
+            # Los eventos quedan marcados con la versión que ya tiene la fila
+            registrar_cambios(db, ayto.id, actuales, respuestas, autor=autor, version=datos.version)
+            compactar(db, ayto.id)
+            indexar_municipio(db, ayto.id, respuestas, datos.notas)
+
+            version_subida = datos.version != version_anterior
+            db.commit()
+            return datos, respuestas, nivel, version_subida
+        except (StaleDataError, IntegrityError) as e:
+            db.rollback()
+            print(f"🔁 Guardado concurrente en {ayto.id} (intento {intento}/{MAX_REINTENTOS}): {e.__class__.__name__}")
+        except ConflictoEdicion:
+            db.rollback()
+            raise
+
+    raise ConflictoEdicion("No se pudo guardar: demasiadas escrituras simultáneas. Inténtalo de nuevo.")
+
+
+# -----------------------------------------------------
+# Escritura del Excel
+# -----------------------------------------------------
+# Dentro del proceso la comprobación y el reemplazo van bajo el mismo cerrojo;
+# entre procesos la firma (mtime, tamaño) detecta que otro ha escrito el fichero.
+_excel_lock = threading.Lock()
+
+
+def _firma(path):
+    estado = os.stat(path)
+    return estado.st_mtime_ns, estado.st_size
+
+
+def reescribir_excel(path, aplicar, reintentos=MAX_REINTENTOS):
+    """
+    Lee el Excel, llama a aplicar(df) y lo vuelve a escribir sin pisar escrituras ajenas.
+
+    Se escribe en un fichero temporal del mismo directorio y se sustituye con os.replace
+    (atómico) solo si el Excel sigue siendo el que se leyó; si no, se repite la lectura.
+    Si aplicar devuelve None no se escribe nada. Devuelve lo que devuelva aplicar.
+    """
+    directorio = os.path.dirname(os.path.abspath(path))
+    for intento in range(1, reintentos + 1):
+        firma = _firma(path)
+        df = pd.read_excel(path, engine="openpyxl")
+        resultado = aplicar(df)
+        if resultado is None:
+            return None
+
+        fd, temporal = tempfile.mkstemp(suffix=".xlsx", dir=directorio)
+        os.close(fd)
+        try:
+            df.to_excel(temporal, index=False)
+            with _excel_lock:
+                if _firma(path) == firma:
+                    os.replace(temporal, path)
+                    return resultado
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        print(f"🔁 El Excel ha cambiado mientras se editaba (intento {intento}/{reintentos}), se vuelve a leer.")
+
+    raise ConflictoEdicion("El Excel se está modificando desde otro sitio. Inténtalo de nuevo.")
@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event, exc, func, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -12,6 +14,37 @@ engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+# sync_excel_to_db.py borra el fichero y crea uno nuevo: las conexiones que ya estaban
+# abiertas seguirían leyendo el fichero borrado. Al sacar una conexión del pool se
+# comprueba que el fichero sigue siendo el mismo; si no, el pool abre una nueva.
+def identidad_fichero_bd(url=DATABASE_URL):
+    """(dispositivo, inodo) del fichero SQLite, o None si no existe o no es SQLite."""
+    if not url.startswith("sqlite:///"):
+        return None
+    try:
+        estado = os.stat(url[len("sqlite:///"):])
+    except OSError:
+        return None
+    return estado.st_dev, estado.st_ino
+
+
+def vigilar_fichero(motor, url):
+    """Hace que el pool del motor descarte las conexiones al fichero SQLite de 'url' si se reemplaza."""
+    if not url.startswith("sqlite:///"):
+        return
+
+    @event.listens_for(motor, "connect")
+    def _recordar_fichero(dbapi_connection, registro):
+        registro.info["fichero"] = identidad_fichero_bd(url)
+
+    @event.listens_for(motor, "checkout")
+    def _comprobar_fichero(dbapi_connection, registro, proxy):
+        if registro.info.get("fichero") != identidad_fichero_bd(url):
+            raise exc.DisconnectionError("El fichero de la base de datos se ha reemplazado")
+
+
+vigilar_fichero(engine, DATABASE_URL)
+
 # 3. Crear sesión
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -25,3 +58,48 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def anadir_columnas_nuevas(bind=engine):
+    """
+    create_all crea las tablas que faltan, pero no añade columnas a las que ya existen.
+    Añade con ALTER TABLE las columnas nuevas de los modelos (con su valor por defecto).
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for tabla in Base.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name in existentes:
+                    continue
+                tipo = columna.type.compile(dialect=bind.dialect)
+                sql = f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}'
+                if columna.server_default is not None:
+                    sql += f" NOT NULL DEFAULT {columna.server_default.arg}"
+                conn.execute(text(sql))
+                print(f"🛠️ Columna añadida: {tabla.name}.{columna.name}")
+
+
+def version_datos(db):
+    """
+    Firma barata de las respuestas guardadas: cambia con cada guardado (la versión de cada
+    fila sube en 1), con una ingesta o resincronización y si se regenera la base de datos.
+    Sirve para saber si las estructuras en memoria de un proceso siguen al día.
+    """
+    from app.models import DatosAyuntamiento
+
+    filas, ultimo_id, versiones = db.query(
+        func.count(DatosAyuntamiento.id),
+        func.max(DatosAyuntamiento.id),
+        func.sum(DatosAyuntamiento.version),
+    ).one()
+    return identidad_fichero_bd(str(db.get_bind().url)), filas, ultimo_id, versiones or 0
+
+
+def avanzar_version(version):
+    """Firma esperada tras un guardado de este mismo proceso (una fila, una versión más)."""
+    if version is None:
+        return None
+    return version[:-1] + (version[-1] + 1,)
@@ -0,0 +1,110 @@
+import os
+import threading
+
+import pandas as pd
+
+from app.catalogo import CATEGORICA, EXCEL_PATH, NUMERICA, TEXTO, a_numero, obtener_catalogo
+
+# Las cadenas respaldadas por Arrow ocupan mucho menos que un objeto Python por celda.
+# pyarrow viene con streamlit; si no está instalado se usa el tipo 'string' de pandas.
+try:
+    import pyarrow  # noqa: F401
+    TIPO_TEXTO = "string[pyarrow]"
+except ImportError:
+    TIPO_TEXTO = "string"
+
+
+def memoria_mb(df):
+    """Memoria real del DataFrame (incluye el contenido de las cadenas) en MB."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def _texto_limpio(serie):
+    # Mismo criterio que el catálogo: '2. No ' y '2. No' son la misma respuesta
+    limpia = serie.map(lambda v: str(v).strip() if pd.notna(v) else None)
+    return limpia.where(limpia != "")
+
+
+def _compactar_columna(serie, tipo):
+    if tipo == CATEGORICA:
+        return _texto_limpio(serie).astype("category")
+
+    if tipo == NUMERICA:
+        numeros = pd.to_numeric(serie.map(a_numero), errors="coerce")
+        enteros = numeros.dropna()
+        if (enteros == enteros.round()).all():
+            return numeros.astype("Int64")
+        return numeros.astype("Float64")
+
+    if tipo == TEXTO:
+        return _texto_limpio(serie).astype(TIPO_TEXTO)
+
+    return serie
+
+
+def compactar_dataset(df, catalogo):
+    """
+    Convierte las columnas de respuestas a tipos compactos según el catálogo:
+    categóricas -> category, numéricas -> Int64/Float64, texto libre -> cadenas Arrow.
+    """
+    columnas = {}
+    for pregunta in catalogo.preguntas:
+        if pregunta.columna in df.columns:
+            columnas[pregunta.columna] = _compactar_columna(df[pregunta.columna], pregunta.tipo)
+
+    if catalogo.municipio_col in df.columns:
+        columnas[catalogo.municipio_col] = _texto_limpio(df[catalogo.municipio_col]).astype(TIPO_TEXTO)
+    if catalogo.nivel_col in df.columns:
+        columnas[catalogo.nivel_col] = pd.to_numeric(df[catalogo.nivel_col], errors="coerce").astype("Float64")
+
+    return df.assign(**columnas) if columnas else df
+
+
+def anadir_derivadas(df):
+    """Columnas calculadas a partir de las respuestas; se calculan una sola vez al cargar."""
+    from app.scoring import MotorPuntuacion, cargar_pesos
+
+    motor = MotorPuntuacion(df, cargar_pesos(df))
+    return df.assign(nivel_calculado=pd.array(motor.niveles, dtype="Float64"))
+
+
+def cargar_encuesta(path=EXCEL_PATH):
+    """
+    Carga el Excel de la encuesta con tipos compactos.
+    El informe de memoria (antes / después, en MB) queda en df.attrs["memoria"].
+    """
+    df = pd.read_excel(path, engine="openpyxl")
+    df.columns = [str(c).strip() for c in df.columns]
+    catalogo = obtener_catalogo(path)
+
+    antes = memoria_mb(df)
+    df = compactar_dataset(df, catalogo)
+    despues = memoria_mb(df)
+
+    df.attrs["memoria"] = {"antes_mb": round(float(antes), 3), "despues_mb": round(float(despues), 3)}
+    df.attrs["version"] = catalogo.version
+    print(f"💾 Memoria del dataset: {antes:.2f} MB → {despues:.2f} MB ({antes / max(despues, 1e-9):.1f}x menos)")
+    return df
+
+
+# Un solo dataset por proceso y por versión del Excel, compartido por todas las peticiones / sesiones
+_datasets = {}
+_lock = threading.Lock()
+
+
+def obtener_dataset(path=EXCEL_PATH):
+    """
+    Devuelve el dataset compartido del Excel (se vuelve a cargar cuando cambia el fichero).
+    Es de solo lectura: quien necesite modificarlo debe trabajar sobre df.copy().
+    """
+    estado = os.stat(path)
+    clave = (path, estado.st_mtime_ns, estado.st_size)
+    with _lock:
+        df = _datasets.get(clave)
+        if df is None:
+            df = anadir_derivadas(cargar_encuesta(path))
+            # Las versiones anteriores del mismo Excel ya no se usan
+            for anterior in [k for k in _datasets if k[0] == path]:
+                del _datasets[anterior]
+            _datasets[clave] = df
+    return df
@@ -0,0 +1,186 @@
+"""
+Diferencias celda a celda entre dos versiones del Excel, o entre el Excel y la BD.
+
+Uso por línea de comandos:
+    python -m app.diff_excel data/ENCUESTAS_datosIA.bak.xlsx data/ENCUESTAS_datosIA.xlsx
+    python -m app.diff_excel db data/ENCUESTAS_datosIA.xlsx   # qué cambiaría una resincronización
+"""
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.catalogo import MUNICIPIO_COL
+
+
+def _normalizar_valor(valor):
+    """Mismo valor aunque venga como 1, 1.0, '1' o '1 ' (Excel y JSON no guardan igual los tipos)."""
+    if valor is None or valor is pd.NA or (isinstance(valor, float) and np.isnan(valor)):
+        return None
+    if isinstance(valor, (float, np.floating)) and float(valor).is_integer():
+        return str(int(valor))
+    texto = str(valor).strip()
+    return texto or None
+
+
+class _Vocabulario:
+    """Asigna un entero a cada valor normalizado distinto (0 = vacío), compartido por las dos tablas."""
+
+    def __init__(self):
+        self.ids = {None: 0}
+        self.valores = [None]
+
+    def id(self, valor):
+        normalizado = _normalizar_valor(valor)
+        if normalizado not in self.ids:
+            self.ids[normalizado] = len(self.valores)
+            self.valores.append(normalizado)
+        return self.ids[normalizado]
+
+
+def _codificar(df, clave, vocabulario):
+    """
+    Convierte la tabla en una matriz de enteros (un id por valor normalizado).
+    Cada columna se factoriza por separado: solo se normalizan sus valores distintos.
+    """
+    df = df.rename(columns=lambda c: str(c).strip())
+    municipios = [_normalizar_valor(v) for v in df[clave]]
+    validas = np.array([m is not None for m in municipios], dtype=bool)
+    columnas = [c for c in df.columns if c != clave]
+
+    codigos = np.zeros((int(validas.sum()), len(columnas)), dtype=np.int64)
+    for j, columna in enumerate(columnas):
+        codigos_col, unicos = pd.factorize(df[columna].iloc[validas], use_na_sentinel=True)
+        tabla = np.array([vocabulario.id(v) for v in unicos] + [0], dtype=np.int64)
+        codigos[:, j] = tabla[codigos_col]  # -1 (vacío) apunta al último elemento: 0
+
+    # Las columnas sin ningún valor equivalen a no tener la columna (la BD no guarda vacíos)
+    con_datos = codigos.any(axis=0)
+    indice = pd.Index([m for m in municipios if m is not None], name=clave)
+    # Si un municipio aparece repetido se queda la última fila, como haría la sincronización
+    unicas = ~indice.duplicated(keep="last")
+    return indice[unicas], pd.Index(columnas)[con_datos], codigos[unicas][:, con_datos]
+
+
+def _alinear(codigos, filas, columnas):
+    """Submatriz con las filas y columnas pedidas; las columnas inexistentes (-1) quedan vacías."""
+    resultado = codigos[np.ix_(filas, np.maximum(columnas, 0))] if codigos.shape[1] else np.zeros((len(filas), len(columnas)), dtype=np.int64)
+    resultado[:, columnas < 0] = 0
+    return resultado
+
+
+def _hash_filas(codigos):
+    # Huella de cada fila: suma de los ids con pesos pseudoaleatorios fijos (uint64, con desbordamiento)
+    pesos = np.random.default_rng(0).integers(1, 2**63, size=codigos.shape[1], dtype=np.uint64)
+    return (codigos.astype(np.uint64) * pesos).sum(axis=1, dtype=np.uint64)
+
+
+def diferencias(antes, despues, clave=MUNICIPIO_COL):
+    """
+    Cambios necesarios para pasar de 'antes' a 'despues'.
+
+    1. Cada valor distinto se convierte en un entero, columna a columna.
+    2. Huella de cada fila común: las filas con la misma huella no se vuelven a mirar.
+    3. En las filas cambiadas se comparan las columnas: las que no cambian se descartan
+       y solo se emiten las celdas distintas.
+    """
+    inicio = time.perf_counter()
+    vocabulario = _Vocabulario()
+    filas_a, columnas_a, codigos_a = _codificar(antes, clave, vocabulario)
+    filas_b, columnas_b, codigos_b = _codificar(despues, clave, vocabulario)
+
+    # Se comparan todas las columnas: la que falta en un lado cuenta como vacía
+    filas_comunes = filas_a.intersection(filas_b, sort=False)
+    columnas_comunes = columnas_a.union(columnas_b, sort=False)
+    a = _alinear(codigos_a, filas_a.get_indexer(filas_comunes), columnas_a.get_indexer(columnas_comunes))
+    b = _alinear(codigos_b, filas_b.get_indexer(filas_comunes), columnas_b.get_indexer(columnas_comunes))
+
+    cambiadas = np.flatnonzero(_hash_filas(a) != _hash_filas(b))
+
+    celdas = []
+    columnas_cambiadas = np.array([], dtype=np.int64)
+    if len(cambiadas):
+        sub_a, sub_b = a[cambiadas], b[cambiadas]
+        columnas_cambiadas = np.flatnonzero((sub_a != sub_b).any(axis=0))
+        distintas = sub_a[:, columnas_cambiadas] != sub_b[:, columnas_cambiadas]
+        for i, j in zip(*np.nonzero(distintas)):
+            col = columnas_cambiadas[j]
+            celdas.append({
+                "municipio": filas_comunes[cambiadas[i]],
+                "columna": columnas_comunes[col],
+                "antes": vocabulario.valores[sub_a[i, col]],
+                "despues": vocabulario.valores[sub_b[i, col]],
+            })
+
+    return {
+        "filas_nuevas": filas_b.difference(filas_a, sort=False).tolist(),
+        "filas_borradas": filas_a.difference(filas_b, sort=False).tolist(),
+        "columnas_nuevas": columnas_b.difference(columnas_a, sort=False).tolist(),
+        "columnas_borradas": columnas_a.difference(columnas_b, sort=False).tolist(),
+        "celdas": celdas,
+        "resumen": {
+            "filas_comparadas": len(filas_comunes),
+            "filas_cambiadas": len(cambiadas),
+            "columnas_cambiadas": len(columnas_cambiadas),
+            "celdas_cambiadas": len(celdas),
+            "segundos": round(time.perf_counter() - inicio, 4),
+        },
+    }
+
+
+def leer_excel(path, sheet_name=0):
+    df = pd.read_excel(path, engine="openpyxl", sheet_name=sheet_name)
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+
+def dataframe_desde_db(db, clave=MUNICIPIO_COL):
+    """Respuestas guardadas en DatosAyuntamiento con la misma forma que el Excel."""
+    from app.models import Ayuntamiento, DatosAyuntamiento
+
+    filas = []
+    for nombre, data_json in (
+        db.query(Ayuntamiento.nombre, DatosAyuntamiento.data_json)
+        .join(DatosAyuntamiento, DatosAyuntamiento.ayto_id == Ayuntamiento.id)
+    ):
+        try:
+            fila = json.loads(data_json) if data_json else {}
+        except Exception:
+            fila = {}
+        fila[clave] = nombre
+        filas.append(fila)
+    return pd.DataFrame(filas) if filas else pd.DataFrame(columns=[clave])
+
+
+def imprimir_resumen(resultado, max_celdas=50):
+    resumen = resultado["resumen"]
+    print(f"🔍 {resumen['filas_comparadas']} filas comparadas en {resumen['segundos']} s")
+    print(f"   Filas nuevas: {len(resultado['filas_nuevas'])} | borradas: {len(resultado['filas_borradas'])}")
+    print(f"   Columnas nuevas: {len(resultado['columnas_nuevas'])} | borradas: {len(resultado['columnas_borradas'])}")
+    print(f"   Celdas cambiadas: {resumen['celdas_cambiadas']} en {resumen['filas_cambiadas']} filas")
+    for celda in resultado["celdas"][:max_celdas]:
+        print(f"   • {celda['municipio']} / {celda['columna']}: {celda['antes']!r} → {celda['despues']!r}")
+    if len(resultado["celdas"]) > max_celdas:
+        print(f"   ... y {len(resultado['celdas']) - max_celdas} celdas más")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+
+    origen, destino = sys.argv[1], sys.argv[2]
+    if origen == "db":
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            antes = dataframe_desde_db(db)
+        finally:
+            db.close()
+    else:
+        antes = leer_excel(origen)
+
+    imprimir_resumen(diferencias(antes, leer_excel(destino)))
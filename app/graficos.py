@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from app.catalogo import NUMERICA
+
+# -----------------------------------------------------
+# CONFIGURACIÓN
+# -----------------------------------------------------
+BARRAS = "barras"
+TARTA = "tarta"
+HISTOGRAMA = "histograma"
+TIPOS = (BARRAS, TARTA, HISTOGRAMA)
+
+MAX_CATEGORIAS = 12  # las respuestas menos frecuentes se agrupan en OTROS
+OTROS = "Otros"
+NUM_INTERVALOS = 10  # barras del histograma
+MAX_FIGURAS = 1024  # figuras guardadas en memoria (se descartan las menos usadas)
+COLORES = px.colors.qualitative.Plotly  # los mismos colores que usaba px.bar(color=...)
+
+
+def clave_filtros(filtros):
+    """Forma canónica (ordenada y hashable) de {columna: valor o lista de valores}."""
+    if not filtros:
+        return ()
+    return tuple(
+        (columna, tuple(sorted(str(v) for v in (valores if isinstance(valores, (list, tuple, set)) else [valores]))))
+        for columna, valores in sorted(filtros.items())
+    )
+
+
+def _filtrar(df, filtros):
+    mascara = np.ones(len(df), dtype=bool)
+    for columna, valores in filtros:
+        if columna not in df.columns:
+            raise KeyError(f"Columna de filtro no encontrada: {columna}")
+        texto = df[columna].astype("string").str.strip()
+        mascara &= texto.isin(valores).fillna(False).to_numpy(dtype=bool)
+    return df[mascara]
+
+
+def _recuento(serie, mayusculas=False, max_categorias=MAX_CATEGORIAS):
+    """
+    Frecuencia de cada respuesta, de mayor a menor. Las etiquetas se transforman después
+    de contar (una vez por respuesta distinta, no por fila) y las que pasan de
+    'max_categorias' se suman en OTROS para que la figura sea pequeña.
+    """
+    conteos = serie.value_counts(dropna=True)
+    conteos = conteos[conteos > 0]
+    etiquetas = conteos.index.astype(str).str.strip()
+    if mayusculas:
+        etiquetas = etiquetas.str.upper()
+    conteos = pd.Series(conteos.to_numpy(), index=etiquetas).groupby(level=0, sort=False).sum()
+    conteos = conteos.sort_values(ascending=False, kind="stable")
+
+    if max_categorias and len(conteos) > max_categorias:
+        principales = conteos.iloc[:max_categorias - 1]
+        conteos = pd.concat([principales, pd.Series({OTROS: conteos.iloc[max_categorias - 1:].sum()})])
+    return pd.DataFrame({"Respuesta": conteos.index, "Conteo": conteos.to_numpy()})
+
+
+def _histograma(serie, intervalos=NUM_INTERVALOS):
+    # Se envían los intervalos ya calculados, no todos los valores: el tamaño no depende de las filas
+    valores = pd.to_numeric(serie, errors="coerce").dropna().to_numpy(dtype=float)
+    if not len(valores):
+        return pd.DataFrame({"Intervalo": [], "Conteo": []})
+    conteos, bordes = np.histogram(valores, bins=intervalos)
+    etiquetas = [f"{bordes[i]:g}–{bordes[i + 1]:g}" for i in range(len(conteos))]
+    return pd.DataFrame({"Intervalo": etiquetas, "Conteo": conteos})
+
+
+def construir_figura(df, pregunta, tipo=None, mayusculas=False, max_categorias=MAX_CATEGORIAS):
+    """Figura de Plotly de una pregunta del catálogo. Sin tipo: histograma si es numérica, barras si no."""
+    tipo = tipo or (HISTOGRAMA if pregunta.tipo == NUMERICA else BARRAS)
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de gráfico desconocido: {tipo}")
+    serie = df[pregunta.columna]
+
+    # graph_objects con una sola traza: bastante más rápido que plotly.express y un JSON más pequeño
+    if tipo == HISTOGRAMA:
+        datos = _histograma(serie)
+        figura = go.Figure(go.Bar(x=datos["Intervalo"], y=datos["Conteo"]))
+        figura.update_layout(title=f"Distribución de {pregunta.nombre}", bargap=0, xaxis_title=pregunta.nombre, yaxis_title="Conteo")
+    elif tipo == TARTA:
+        datos = _recuento(serie, mayusculas, max_categorias)
+        figura = go.Figure(go.Pie(labels=datos["Respuesta"], values=datos["Conteo"]))
+        figura.update_layout(title=f"Proporción de {pregunta.nombre}")
+    else:
+        datos = _recuento(serie, mayusculas, max_categorias)
+        colores = [COLORES[i % len(COLORES)] for i in range(len(datos))]
+        figura = go.Figure(go.Bar(x=datos["Respuesta"], y=datos["Conteo"], marker_color=colores))
+        figura.update_layout(title=f"Distribución de Respuestas {pregunta.nombre}", xaxis_title="Respuesta", yaxis_title="Conteo")
+    return figura
+
+
+class CacheGraficos:
+    """
+    Figuras ya serializadas (JSON) por (versión de los datos, pregunta, tipo, filtros, opciones).
+    Al cambiar el Excel cambia la versión y las figuras anteriores dejan de usarse.
+    """
+
+    def __init__(self, max_figuras=MAX_FIGURAS):
+        self.max_figuras = max_figuras
+        self._figuras = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, df, pregunta, tipo=None, filtros=None, mayusculas=False, max_categorias=MAX_CATEGORIAS):
+        filtros = clave_filtros(filtros)
+        clave = (df.attrs.get("version"), pregunta.id, tipo, filtros, mayusculas, max_categorias)
+        with self._lock:
+            if clave in self._figuras:
+                self._figuras.move_to_end(clave)
+                self.aciertos += 1
+                return self._figuras[clave]
+
+        datos = _filtrar(df, filtros) if filtros else df
+        figura = construir_figura(datos, pregunta, tipo, mayusculas, max_categorias).to_json()
+
+        with self._lock:
+            self.fallos += 1
+            self._figuras[clave] = figura
+            while len(self._figuras) > self.max_figuras:
+                self._figuras.popitem(last=False)
+        return figura
+
+    def precalcular(self, df, catalogo, tipo=None):
+        """Genera de antemano la figura por defecto de todas las preguntas P."""
+        for pregunta in catalogo.preguntas:
+            if pregunta.columna in df.columns:
+                self.obtener(df, pregunta, tipo)
+        return len(self._figuras)
+
+
+# Una caché por proceso, compartida por todas las sesiones / peticiones
+cache_graficos = CacheGraficos()
@@ -0,0 +1,133 @@
+import json
+
+from sqlalchemy import func
+
+from app.models import CambioRespuesta, DatosAyuntamiento, InstantaneaAyuntamiento, ahora
+
+# Cada cuántos cambios de un municipio se guarda una instantánea nueva.
+# Reconstruir una fecha cuesta, como mucho, aplicar este número de eventos.
+UMBRAL_COMPACTACION = 50
+
+
+def _cargar(data_json):
+    try:
+        return json.loads(data_json) if data_json else {}
+    except Exception:
+        return {}
+
+
+def _ultima_instantanea(db, ayto_id, fecha=None):
+    consulta = db.query(InstantaneaAyuntamiento).filter(InstantaneaAyuntamiento.ayto_id == ayto_id)
+    if fecha is not None:
+        consulta = consulta.filter(InstantaneaAyuntamiento.fecha <= fecha)
+    return consulta.order_by(InstantaneaAyuntamiento.ultimo_cambio_id.desc()).first()
+
+
+def registrar_cambios(db, ayto_id, anteriores, nuevos, autor=None, version=None):
+    """
+    Añade un evento por cada pregunta cuyo valor cambia. No hace commit: los eventos
+    se guardan en la misma transacción que la actualización de data_json.
+    'version' es la versión de DatosAyuntamiento que resulta del guardado.
+    """
+    cambios = [
+        (pregunta, anteriores.get(pregunta), valor)
+        for pregunta, valor in nuevos.items()
+        if anteriores.get(pregunta) != valor
+    ]
+    if not cambios:
+        return []
+
+    # La primera vez que se edita un municipio se guarda su estado de partida
+    if _ultima_instantanea(db, ayto_id) is None:
+        db.add(InstantaneaAyuntamiento(
+            ayto_id=ayto_id,
+            ultimo_cambio_id=0,
+            fecha=ahora(),
+            data_json=json.dumps(anteriores, ensure_ascii=False),
+        ))
+
+    fecha = ahora()
+    eventos = [
+        CambioRespuesta(
+            ayto_id=ayto_id,
+            pregunta=pregunta,
+            valor_anterior=json.dumps(anterior, ensure_ascii=False),
+            valor_nuevo=json.dumps(nuevo, ensure_ascii=False),
+            fecha=fecha,
+            autor=autor,
+            version=version,
+        )
+        for pregunta, anterior, nuevo in cambios
+    ]
+    db.add_all(eventos)
+    return eventos
+
+
+def estado_en(db, ayto_id, fecha=None):
+    """
+    Respuestas de un municipio en una fecha (None = ahora): la instantánea más cercana
+    anterior a la fecha más los eventos posteriores a ella.
+    """
+    instantanea = _ultima_instantanea(db, ayto_id, fecha)
+    if instantanea is None:
+        # Fecha anterior a la primera instantánea: vale el estado de partida
+        instantanea = (
+            db.query(InstantaneaAyuntamiento)
+            .filter(InstantaneaAyuntamiento.ayto_id == ayto_id)
+            .order_by(InstantaneaAyuntamiento.ultimo_cambio_id)
+            .first()
+        )
+    if instantanea is None:
+        # Nunca se ha editado: el estado actual es el de cualquier fecha
+        datos = db.query(DatosAyuntamiento).filter_by(ayto_id=ayto_id).first()
+        return _cargar(datos.data_json) if datos else {}
+
+    estado = _cargar(instantanea.data_json)
+    eventos = db.query(CambioRespuesta).filter(
+        CambioRespuesta.ayto_id == ayto_id,
+        CambioRespuesta.id > instantanea.ultimo_cambio_id,
+    )
+    if fecha is not None:
+        eventos = eventos.filter(CambioRespuesta.fecha <= fecha)
+    for evento in eventos.order_by(CambioRespuesta.id):
+        estado[evento.pregunta] = json.loads(evento.valor_nuevo)
+    return estado
+
+
+def encuesta_en(db, fecha=None):
+    """Respuestas de todos los municipios en una fecha: {ayto_id: {pregunta: valor}}."""
+    ids = [ayto_id for (ayto_id,) in db.query(DatosAyuntamiento.ayto_id)]
+    return {ayto_id: estado_en(db, ayto_id, fecha) for ayto_id in ids}
+
+
+def compactar(db, ayto_id=None, umbral=UMBRAL_COMPACTACION):
+    """
+    Guarda una instantánea nueva de los municipios con 'umbral' o más eventos desde
+    la última. Los eventos no se borran: el historial completo se conserva.
+    Devuelve el número de instantáneas creadas (no hace commit).
+    """
+    db.flush()
+    ultimas = (
+        db.query(InstantaneaAyuntamiento.ayto_id, func.max(InstantaneaAyuntamiento.ultimo_cambio_id))
+        .group_by(InstantaneaAyuntamiento.ayto_id)
+    )
+    if ayto_id is not None:
+        ultimas = ultimas.filter(InstantaneaAyuntamiento.ayto_id == ayto_id)
+
+    creadas = 0
+    for id_ayto, ultimo_id in ultimas.all():
+        pendientes = db.query(func.count(CambioRespuesta.id), func.max(CambioRespuesta.id)).filter(
+            CambioRespuesta.ayto_id == id_ayto, CambioRespuesta.id > ultimo_id
+        ).one()
+        if pendientes[0] < umbral:
+            continue
+
+        ultimo_evento = db.get(CambioRespuesta, pendientes[1])
+        db.add(InstantaneaAyuntamiento(
+            ayto_id=id_ayto,
+            ultimo_cambio_id=ultimo_evento.id,
+            fecha=ultimo_evento.fecha,
+            data_json=json.dumps(estado_en(db, id_ayto), ensure_ascii=False),
+        ))
+        creadas += 1
+    return creadas
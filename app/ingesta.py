@@ -0,0 +1,333 @@
+"""
+Ingesta en paralelo de varios Excel (un libro por comarca, una hoja por oleada...).
+
+Uso por línea de comandos:
+    python -m app.ingesta data/comarcas/                     # todos los .xlsx de la carpeta, todas las hojas
+    python -m app.ingesta "data/comarcas/*.xlsx" --hojas Hoja1
+    python -m app.ingesta data/comarcas/ --dry-run --informe informe.json
+    python -m app.ingesta data/comarcas/ --estricto          # una respuesta no válida rechaza la hoja
+    python -m app.ingesta data/valencia/ --region valencia
+
+1. Cada hoja de cada libro se lee y se valida contra el catálogo de preguntas en un
+   proceso distinto (ProcessPoolExecutor): el tiempo total baja con el número de núcleos.
+   Las respuestas que el catálogo no admite se descartan (solo esas celdas: el resto de la
+   fila se carga; con --estricto se rechaza la hoja entera) y el comando termina con código 1.
+2. Las hojas se fusionan por municipio: si un municipio aparece varias veces, gana el
+   último valor no vacío (en orden de fichero y de hoja).
+3. Todo se carga en la BD en una sola transacción, con historial de cambios.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from app.catalogo import (
+    CATEGORICA, EXCEL_PATH, MUNICIPIO_COL, NIVEL_COL, NUMERICA, PREFIJO_PONDER,
+    Catalogo, a_numero, obtener_catalogo,
+)
+
+MAX_EJEMPLOS = 5  # valores no válidos que se muestran por columna en el informe
+
+
+def expandir_fuentes(rutas):
+    """Ficheros .xlsx de una lista de carpetas, patrones glob o ficheros (sin los ~$ de Excel abierto)."""
+    ficheros = []
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            candidatos = glob.glob(os.path.join(ruta, "*.xlsx"))
+        elif any(c in ruta for c in "*?["):
+            candidatos = glob.glob(ruta)
+        else:
+            candidatos = [ruta]
+        ficheros += sorted(c for c in candidatos if not os.path.basename(c).startswith("~$"))
+    # Sin repetidos y en un orden estable: el orden decide qué valor gana al fusionar
+    return list(dict.fromkeys(ficheros))
+
+
+def listar_hojas(path, hojas=None):
+    from openpyxl import load_workbook
+
+    libro = load_workbook(path, read_only=True)
+    try:
+        nombres = libro.sheetnames
+    finally:
+        libro.close()
+    return [h for h in nombres if not hojas or h in hojas]
+
+
+def _validar(df, catalogo):
+    """
+    Comprueba la hoja contra el catálogo. Devuelve (avisos, invalidos, celdas):
+    avisos de columnas desconocidas, un mensaje por columna con respuestas que el catálogo
+    no admite y, por cada una de esas columnas, la máscara de sus celdas no válidas.
+    """
+    avisos, invalidos, celdas = [], [], {}
+    tipos = catalogo.tipos()
+    desconocidas = [
+        c for c in df.columns
+        if c not in tipos and c not in (MUNICIPIO_COL, NIVEL_COL) and not c.upper().startswith(PREFIJO_PONDER)
+    ]
+    if desconocidas:
+        avisos.append(f"{len(desconocidas)} columnas que no están en el catálogo: {desconocidas[:MAX_EJEMPLOS]}")
+
+    for columna in df.columns:
+        tipo = tipos.get(columna)
+        if tipo not in (CATEGORICA, NUMERICA):
+            continue
+        texto = df[columna].map(lambda v: str(v).strip() if pd.notna(v) else "")
+        if tipo == CATEGORICA:
+            permitidos = set(catalogo.pregunta(columna).valores)
+            if not permitidos:
+                continue
+            malas = (texto != "") & ~texto.isin(permitidos)
+        else:
+            malas = (texto != "") & texto.map(lambda v: a_numero(v) is None)
+        if malas.any():
+            ejemplos = sorted(set(texto[malas]))
+            invalidos.append(f"'{columna}': {int(malas.sum())} respuestas no válidas, p. ej. {ejemplos[:MAX_EJEMPLOS]}")
+            celdas[columna] = malas
+    return avisos, invalidos, celdas
+
+
+def _informe(path, hoja, error=None):
+    return {"fichero": path, "hoja": hoja, "filas": 0, "municipios": 0, "descartadas": 0,
+            "avisos": [], "invalidos": [], "error": error, "segundos": 0.0}
+
+
+def leer_hoja(path, hoja, catalogo_dict, estricto=False):
+    """
+    Trabajo de cada proceso: lee una hoja, limpia cabeceras y municipios y la valida.
+    Las respuestas no válidas se quedan vacías y el resto de su fila se conserva
+    (con 'estricto' se rechaza toda la hoja).
+    Nunca lanza excepciones: los errores vuelven en el informe de la hoja.
+    """
+    inicio = time.perf_counter()
+    informe = _informe(path, hoja)
+    df = None
+    try:
+        catalogo = Catalogo.from_dict(catalogo_dict)
+        df = pd.read_excel(path, sheet_name=hoja, engine="openpyxl")
+        df.columns = [str(c).strip() for c in df.columns]
+        informe["filas"] = len(df)
+
+        if MUNICIPIO_COL not in df.columns:
+            raise ValueError(f"No existe la columna '{MUNICIPIO_COL}'")
+        municipios = df[MUNICIPIO_COL].map(lambda v: str(v).strip() if pd.notna(v) else "")
+        vacias = municipios.str.lower().isin(["", "nan", "sin nombre"])
+        if vacias.any():
+            informe["avisos"].append(f"{int(vacias.sum())} filas sin municipio, se descartan")
+        df = df[~vacias.to_numpy()].assign(**{MUNICIPIO_COL: municipios[~vacias]})
+        avisos, invalidos, celdas = _validar(df, catalogo)
+        informe["avisos"] += avisos
+        informe["invalidos"] = invalidos
+        descartadas = sum(int(malas.sum()) for malas in celdas.values())
+        if descartadas:
+            if estricto:
+                raise ValueError(f"Hoja rechazada: {descartadas} respuestas no válidas")
+            informe["descartadas"] = descartadas
+            # Una celda vacía no pisa al cargar ni al fusionar: se mantiene el valor que ya hubiera
+            for columna, malas in celdas.items():
+                df[columna] = df[columna].mask(malas)
+        informe["municipios"] = int(df[MUNICIPIO_COL].nunique())
+    except Exception as e:
+        informe["error"] = f"{e.__class__.__name__}: {e}"
+        df = None
+    informe["segundos"] = round(time.perf_counter() - inicio, 3)
+    return informe, df
+
+
+def leer_en_paralelo(ficheros, hojas=None, catalogo=None, procesos=None, estricto=False):
+    """Lee todas las hojas en paralelo. Devuelve (informes, DataFrames válidos en orden de fichero y hoja)."""
+    catalogo_dict = (catalogo or obtener_catalogo(EXCEL_PATH)).to_dict()
+    informes, trabajos = [], []
+    for path in ficheros:
+        try:
+            trabajos += [(path, hoja) for hoja in listar_hojas(path, hojas)]
+        except Exception as e:
+            informes.append(_informe(path, None, f"{e.__class__.__name__}: {e}"))
+
+    resultados = {}
+    if trabajos:
+        with ProcessPoolExecutor(max_workers=procesos or min(len(trabajos), os.cpu_count() or 1)) as pool:
+            futuros = {pool.submit(leer_hoja, path, hoja, catalogo_dict, estricto): (path, hoja) for path, hoja in trabajos}
+            for futuro in as_completed(futuros):
+                path, hoja = futuros[futuro]
+                try:
+                    resultados[(path, hoja)] = futuro.result()
+                except Exception as e:  # el proceso ha muerto (memoria, señal...)
+                    resultados[(path, hoja)] = (_informe(path, hoja, f"{e.__class__.__name__}: {e}"), None)
+
+    tablas = []
+    for trabajo in trabajos:
+        informe, df = resultados[trabajo]
+        informes.append(informe)
+        if df is not None:
+            tablas.append(df)
+    return informes, tablas
+
+
+def fusionar(tablas):
+    """Una fila por municipio: para cada columna, el último valor no vacío."""
+    if not tablas:
+        return pd.DataFrame(columns=[MUNICIPIO_COL])
+    # copy() deja el resultado en bloques consolidados (sin el PerformanceWarning del groupby)
+    todas = pd.concat(tablas, ignore_index=True, sort=False).copy()
+    return todas.groupby(MUNICIPIO_COL, sort=False).last().reset_index()
+
+
+def _valor_python(valor):
+    valor = valor.item() if hasattr(valor, "item") else valor
+    # Al fusionar hojas las columnas enteras con huecos pasan a float: 3.0 vuelve a ser 3
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def _registro(fila):
+    # Solo las respuestas con valor, con tipos de Python (como guarda la sincronización)
+    return {
+        columna: _valor_python(valor)
+        for columna, valor in fila.items()
+        if columna != MUNICIPIO_COL and pd.notna(valor)
+    }
+
+
+def cargar(db, fusionado, autor="ingesta"):
+    """
+    Inserta o actualiza todos los municipios en una sola transacción (hace commit al final
+    y rollback si algo falla). Devuelve {"nuevos": n, "actualizados": n, "cambios": n}.
+    """
+    from app.busqueda import indexar_municipio
+    from app.historial import registrar_cambios
+    from app.models import Ayuntamiento, DatosAyuntamiento
+    from app.scoring import MotorPuntuacion, cargar_pesos
+
+    resumen = {"nuevos": 0, "actualizados": 0, "cambios": 0}
+    try:
+        existentes = {a.nombre.strip().lower(): a for a in db.query(Ayuntamiento)}
+        pendientes = []
+        for _, fila in fusionado.iterrows():
+            nombre = fila[MUNICIPIO_COL]
+            ayto = existentes.get(nombre.lower())
+            if ayto is None:
+                ayto = Ayuntamiento(codigo=nombre.lower().replace(" ", "_"), nombre=nombre, password="1234")
+                db.add(ayto)
+                db.flush()
+                existentes[nombre.lower()] = ayto
+                resumen["nuevos"] += 1
+            else:
+                resumen["actualizados"] += 1
+
+            datos = db.query(DatosAyuntamiento).filter_by(ayto_id=ayto.id).first()
+            if datos is None:
+                datos = DatosAyuntamiento(ayto_id=ayto.id, data_json="{}")
+                db.add(datos)
+                db.flush()
+            try:
+                anteriores = json.loads(datos.data_json) if datos.data_json else {}
+            except Exception:
+                anteriores = {}
+            respuestas = {**anteriores, **_registro(fila)}
+            respuestas = json.loads(json.dumps(respuestas, ensure_ascii=False, default=str))
+            pendientes.append((ayto, datos, anteriores, respuestas))
+
+        # Nivel de todos los municipios cargados en una sola pasada
+        completas = pd.DataFrame.from_dict({ayto.id: r for ayto, _, _, r in pendientes}, orient="index")
+        motor = MotorPuntuacion(completas, cargar_pesos(fusionado))
+
+        for ayto, datos, anteriores, respuestas in pendientes:
+            # Como en guardar_respuestas: un solo UPDATE por fila y los eventos con su versión
+            datos.data_json = json.dumps(respuestas, ensure_ascii=False)
+            nivel = motor.nivel(ayto.id)
+            if nivel is not None:
+                datos.nivel_digitalizacion = nivel
+                ayto.nivel_digitalizacion = nivel
+            db.flush()
+            eventos = registrar_cambios(db, ayto.id, anteriores, respuestas, autor=autor, version=datos.version)
+            resumen["cambios"] += len(eventos)
+            indexar_municipio(db, ayto.id, respuestas, datos.notas)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return resumen
+
+
+def imprimir_informe(informes, total_segundos):
+    print(f"\n📋 Informe de ingesta ({len(informes)} hojas)")
+    for i in informes:
+        estado = "❌" if i["error"] or i["invalidos"] else ("⚠️" if i["avisos"] else "✅")
+        print(f"{estado} {os.path.basename(i['fichero'])} [{i['hoja']}]: {i['filas']} filas, "
+              f"{i['municipios']} municipios, {i['segundos']} s")
+        if i["error"]:
+            print(f"     Error: {i['error']}")
+        if i["descartadas"]:
+            print(f"     {i['descartadas']} respuestas no válidas descartadas (se carga el resto de sus filas)")
+        for invalido in i["invalidos"]:
+            print(f"     ✗ {invalido}")
+        for aviso in i["avisos"]:
+            print(f"     • {aviso}")
+    trabajo = sum(i["segundos"] for i in informes)
+    print(f"⏱️ {total_segundos:.2f} s en total ({trabajo:.2f} s de lectura repartidos entre procesos)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingesta en paralelo de varios Excel de la encuesta.")
+    parser.add_argument("rutas", nargs="+", help="carpetas, patrones glob o ficheros .xlsx")
+    parser.add_argument("--hojas", help="solo estas hojas (separadas por comas)")
+    parser.add_argument("--procesos", type=int, help="número de procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--region", help="región de destino (data/shards.json)")
+    parser.add_argument("--dry-run", action="store_true", help="leer y validar sin tocar la base de datos")
+    parser.add_argument("--estricto", action="store_true", help="rechazar la hoja entera si tiene alguna respuesta no válida")
+    parser.add_argument("--informe", help="guardar el informe en este fichero JSON")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    ficheros = expandir_fuentes(args.rutas)
+    if not ficheros:
+        print("❌ No se encontró ningún fichero .xlsx.")
+        sys.exit(1)
+
+    hojas = [h.strip() for h in args.hojas.split(",")] if args.hojas else None
+    informes, tablas = leer_en_paralelo(ficheros, hojas, procesos=args.procesos, estricto=args.estricto)
+    fusionado = fusionar(tablas)
+    print(f"🔗 {len(tablas)} hojas fusionadas: {len(fusionado)} municipios, {fusionado.shape[1] - 1} columnas.")
+
+    resultado = {"hojas": informes, "municipios": len(fusionado), "carga": None}
+    if args.dry_run:
+        print("ℹ️ Simulación: no se ha modificado la base de datos.")
+    elif len(fusionado):
+        from app.busqueda import crear_indice
+
+        if args.region:
+            from app.shards import obtener_router
+            regiones = obtener_router()
+            crear_indice(regiones.engine(args.region))
+            db = regiones.sesion(args.region)
+        else:
+            from app.database import Base, SessionLocal, engine
+            Base.metadata.create_all(bind=engine)
+            crear_indice(engine)
+            db = SessionLocal()
+        try:
+            resultado["carga"] = cargar(db, fusionado)
+        finally:
+            db.close()
+        c = resultado["carga"]
+        print(f"💾 Carga completada: {c['nuevos']} municipios nuevos, {c['actualizados']} actualizados, {c['cambios']} respuestas cambiadas.")
+
+    total = time.perf_counter() - inicio
+    imprimir_informe(informes, total)
+    resultado["segundos"] = round(total, 3)
+    if args.informe:
+        with open(args.informe, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=1, default=str)
+        print(f"📝 Informe guardado en {args.informe}")
+    # Código 1 si alguna hoja no se pudo leer o tenía respuestas no válidas
+    sys.exit(1 if any(i["error"] or i["invalidos"] for i in informes) else 0)
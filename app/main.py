@@ -1,18 +1,74 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request, Form, Depends
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
-import pandas as pd
 
-from app.database import get_db
-from app.models import Ayuntamiento
+from app.database import engine, SessionLocal
+from app.models import Ayuntamiento, DatosAyuntamiento
+from app.catalogo import EXCEL_PATH, obtener_catalogo
+from app.arranque import arrancar, estado, precalcular_graficos
+from app.concurrencia import ConflictoEdicion, guardar_respuestas
+from app.ranking import obtener_indice
+from app.scoring import obtener_motor
+from app.shards import REGION_POR_DEFECTO, obtener_router
+from app.tareas import PRIORIDAD_ALTA, encolar, planificador
+from app.routers import comparativa, historial, diff, busqueda, tareas, regiones, graficos
+
+# Configuración de plantillas
+templates = Jinja2Templates(directory="app/templates")
+
 
-app = FastAPI()
+def iniciar():
+    # Con el esquema de la BD al día ya se pueden ejecutar las tareas en segundo plano
+    if arrancar(engine, SessionLocal, templates).listo:
+        planificador.iniciar()
+        # Con la aplicación ya lista, las figuras por defecto de /api/graficos
+        precalcular_graficos()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Lo costoso (catálogo y mappers, plantillas, primera conexión y esquema de la BD) se hace
+    # en segundo plano: /healthz responde desde el principio y /readyz solo cuando termina
+    calentamiento = asyncio.create_task(asyncio.to_thread(iniciar))
+    yield
+    await calentamiento
+    planificador.detener()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Estáticos (solo si la carpeta existe)
+if os.path.isdir("app/static"):
+    app.mount("/static", StaticFiles(directory="app/static"), name="static")
+
+# Routers de la API
+app.include_router(comparativa.router)
+app.include_router(historial.router)
+app.include_router(diff.router)
+app.include_router(busqueda.router)
+app.include_router(tareas.router)
+app.include_router(regiones.router)
+app.include_router(graficos.router)
+
+
+# ------------------------------------------------------
+# Sondas: vivo (/healthz) y listo para recibir tráfico (/readyz)
+# ------------------------------------------------------
+@app.get("/healthz")
+def healthz():
+    return {"estado": "ok"}
 
-# Configuración de plantillas y estáticos
-templates = Jinja2Templates(directory="app/templates")
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+
+@app.get("/readyz")
+def readyz():
+    return JSONResponse(estado.to_dict(), status_code=200 if estado.listo else 503)
 
 
 # ------------------------------------------------------
@@ -31,10 +87,22 @@ def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request, "msg": None})
 
 
+def sesion_region(request: Request):
+    """Sesión de la BD de la región del municipio que ha iniciado sesión (la de siempre si no hay)."""
+    codigo = request.cookies.get("codigo")
+    db = obtener_router().sesion_para(codigo) if codigo else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 @app.post("/login")
-def login(request: Request, codigo: str = Form(...), db: Session = Depends(get_db)):
-    ayto = db.query(Ayuntamiento).filter_by(codigo=codigo).first()
-    if not ayto:
+def login(request: Request, codigo: str = Form(...)):
+    # El municipio se busca en la base de datos de su región
+    with obtener_router().sesion_para(codigo) as db:
+        existe = db.query(Ayuntamiento.id).filter_by(codigo=codigo).first() is not None
+    if not existe:
         return templates.TemplateResponse(
             "login.html",
             {"request": request, "msg": "Código incorrecto. Inténtelo de nuevo."}
@@ -58,25 +126,23 @@ def logout():
 # ------------------------------------------------------
 # Página principal de datos (Data Input)
 # ------------------------------------------------------
-@app.get("/data_input")
-def data_input(request: Request, db: Session = Depends(get_db)):
-    codigo = request.cookies.get("codigo")
-    if not codigo:
-        return RedirectResponse("/login")
-
-    ayto = db.query(Ayuntamiento).filter_by(codigo=codigo).first()
-    if not ayto:
-        return RedirectResponse("/login")
+def _pantalla_datos(request, ayto, db, msg=None, conflicto=False, status_code=200):
+    datos = db.query(DatosAyuntamiento).filter_by(ayto_id=ayto.id).first()
+    current = {}
+    if datos and datos.data_json:
+        try:
+            current = json.loads(datos.data_json)
+        except Exception:
+            current = {}
 
     # Nivel de digitalización (si existe en la BD o en el Excel)
     nivel_digitalizacion = getattr(ayto, "nivel_digitalizacion", None)
     if not nivel_digitalizacion:
         nivel_digitalizacion = "No definido"
 
-    # Leer columnas del Excel
+    # Columnas de preguntas del catálogo (no hace falta leer el Excel en cada petición)
     try:
-        df = pd.read_excel("data/ENCUESTAS_datosIA.xlsx")
-        p_columns = list(df.columns)
+        p_columns = obtener_catalogo(EXCEL_PATH).columnas()
     except Exception as e:
         p_columns = []
         print(f"⚠️ Error al leer el Excel: {e}")
@@ -88,11 +154,29 @@ def data_input(request: Request, db: Session = Depends(get_db)):
             "ayto": ayto,
             "nivel_digitalizacion": nivel_digitalizacion,
             "p_columns": p_columns,
-            "msg": None
-        }
+            "current": current,
+            # Se devuelve al guardar para detectar ediciones simultáneas
+            "version": datos.version if datos else None,
+            "msg": msg,
+            "conflicto": conflicto,
+        },
+        status_code=status_code,
     )
 
 
+@app.get("/data_input")
+def data_input(request: Request, db: Session = Depends(sesion_region)):
+    codigo = request.cookies.get("codigo")
+    if not codigo:
+        return RedirectResponse("/login")
+
+    ayto = db.query(Ayuntamiento).filter_by(codigo=codigo).first()
+    if not ayto:
+        return RedirectResponse("/login")
+
+    return _pantalla_datos(request, ayto, db)
+
+
 # ------------------------------------------------------
 # Procesar formulario (guardar datos)
 # ------------------------------------------------------
@@ -105,7 +189,8 @@ def update_data(
     val2: str = Form(None),
     col3: str = Form(None),
     val3: str = Form(None),
-    db: Session = Depends(get_db)
+    version: str = Form(""),
+    db: Session = Depends(sesion_region)
 ):
     codigo = request.cookies.get("codigo")
     if not codigo:
@@ -115,30 +200,39 @@ def update_data(
     if not ayto:
         return RedirectResponse("/login")
 
-    # Leer Excel y actualizar (solo en memoria, de momento)
-    df = pd.read_excel("data/ENCUESTAS_datosIA.xlsx")
-
-    if codigo in df["Código"].astype(str).values:
-        row_index = df[df["Código"].astype(str) == codigo].index[0]
-        for col, val in [(col1, val1), (col2, val2), (col3, val3)]:
-            if col and col in df.columns:
-                df.at[row_index, col] = val
-
-        df.to_excel("data/ENCUESTAS_datosIA.xlsx", index=False)
-        msg = "Datos actualizados correctamente."
-    else:
-        msg = "No se encontró el municipio en el Excel."
-
-    nivel_digitalizacion = getattr(ayto, "nivel_digitalizacion", None) or "No definido"
-    p_columns = list(df.columns)
-
-    return templates.TemplateResponse(
-        "data_input.html",
-        {
-            "request": request,
-            "ayto": ayto,
-            "nivel_digitalizacion": nivel_digitalizacion,
-            "p_columns": p_columns,
-            "msg": msg
-        }
-    )
+    # 1. Guardar en la BD con control de versión (con historial e índice de búsqueda):
+    #    si otro usuario ha cambiado las mismas preguntas desde que se abrió el formulario,
+    #    no se pisan sus respuestas
+    cambios = {col: val for col, val in [(col1, val1), (col2, val2), (col3, val3)] if col}
+    # El motor y el índice se piden antes de guardar: así siguen al día con la versión anterior
+    # y el guardado los avanza (si se pidieran después, verían un cambio ajeno y se reconstruirían)
+    motor, indice = obtener_motor(db), obtener_indice(db)
+    try:
+        datos, respuestas, _, version_subida = guardar_respuestas(
+            db,
+            ayto,
+            cambios,
+            version_base=int(version) if version.isdigit() else None,
+            autor=codigo,
+            calcular_nivel=motor.calcular_nivel,
+        )
+    except ConflictoEdicion as e:
+        detalle = "; ".join(
+            f"{c['pregunta']}: ahora vale {c['actual']!r} ({c['autor'] or 'otro usuario'})"
+            for c in e.conflictos
+        )
+        msg = f"{e}. {detalle}. Revisa los valores y vuelve a guardar." if detalle else str(e)
+        return _pantalla_datos(request, ayto, db, msg, conflicto=True, status_code=409)
+
+    # 2. Con el cambio confirmado, actualizar la fila del motor de puntuación y la comparativa
+    motor.actualizar_respuestas(ayto.id, respuestas, version_subida)
+    indice.actualizar(ayto.id, respuestas, datos.nivel_digitalizacion, version_subida)
+
+    # 3. Reescribir el Excel completo es lento: se encola y lo hace el planificador de tareas
+    #    (en el Excel de la región del municipio; la cola de tareas vive en la BD de siempre)
+    region = obtener_router().region_de(codigo) or REGION_POR_DEFECTO
+    parametros = {"codigo": codigo, "municipio": ayto.nombre, "region": region, "cambios": cambios}
+    with SessionLocal() as db_tareas:
+        tarea_id = encolar(db_tareas, "escribir_excel", parametros, PRIORIDAD_ALTA).id
+    msg = f"Datos guardados. Se escribirán en el Excel en segundo plano (tarea {tarea_id})."
+    return _pantalla_datos(request, ayto, db, msg)
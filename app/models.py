@@ -1,8 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, DateTime, Index, text
 from sqlalchemy.orm import relationship
 from app.database import Base
 
 
+def ahora():
+    """Fecha actual en UTC (sin zona horaria, como la guarda SQLite)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class Ayuntamiento(Base):
     __tablename__ = "ayuntamientos"
 
@@ -34,6 +40,74 @@ class DatosAyuntamiento(Base):
     nivel_digitalizacion = Column(Float, nullable=True)
     data_json = Column(Text, nullable=True)  # JSON serializado con todas las columnas del Excel
     notas = Column(Text, nullable=True)
+    # Versión de la fila: cada UPDATE comprueba que no ha cambiado (WHERE version = ?) y la incrementa
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
     # 🔗 Relación inversa con Ayuntamiento
     ayuntamiento = relationship("Ayuntamiento", back_populates="datos")
+
+
+class CambioRespuesta(Base):
+    """Registro de solo inserción: un evento por cada respuesta modificada."""
+    __tablename__ = "cambios_respuesta"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ayto_id = Column(Integer, ForeignKey("ayuntamientos.id"), nullable=False)
+    pregunta = Column(String, nullable=False)
+    valor_anterior = Column(Text, nullable=True)  # JSON del valor (conserva números y textos)
+    valor_nuevo = Column(Text, nullable=True)
+    fecha = Column(DateTime, default=ahora, nullable=False)
+    autor = Column(String, nullable=True)
+    version = Column(Integer, nullable=True)  # versión de DatosAyuntamiento que creó el cambio
+
+    __table_args__ = (
+        Index("ix_cambios_respuesta_ayto_id_id", "ayto_id", "id"),
+        Index("ix_cambios_respuesta_fecha", "fecha"),
+    )
+
+
+class InstantaneaAyuntamiento(Base):
+    """Estado completo de las respuestas de un municipio tras el cambio 'ultimo_cambio_id'."""
+    __tablename__ = "instantaneas_ayuntamiento"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ayto_id = Column(Integer, ForeignKey("ayuntamientos.id"), nullable=False)
+    ultimo_cambio_id = Column(Integer, nullable=False, default=0)  # 0 = estado antes de cualquier cambio
+    fecha = Column(DateTime, default=ahora, nullable=False)
+    data_json = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_instantaneas_ayto_id_fecha", "ayto_id", "fecha"),
+    )
+
+
+class Tarea(Base):
+    """Cola persistente de trabajos en segundo plano (ver app/tareas.py)."""
+    __tablename__ = "tareas"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tipo = Column(String, nullable=False)
+    parametros = Column(Text, nullable=True)  # JSON
+    clave = Column(String, nullable=False)  # tipo + parámetros: identifica tareas idénticas
+    prioridad = Column(Integer, nullable=False, default=0)  # mayor = antes
+    estado = Column(String, nullable=False, default="pendiente")  # pendiente / en_curso / completada / fallida
+    progreso = Column(Float, nullable=False, default=0.0)  # 0 a 1
+    mensaje = Column(Text, nullable=True)
+    resultado = Column(Text, nullable=True)  # JSON
+    intentos = Column(Integer, nullable=False, default=0)
+    max_intentos = Column(Integer, nullable=False, default=3)
+    ejecutar_desde = Column(DateTime, default=ahora, nullable=False)
+    creada = Column(DateTime, default=ahora, nullable=False)
+    iniciada = Column(DateTime, nullable=True)
+    terminada = Column(DateTime, nullable=True)
+    # Proceso que la ejecuta y su último latido: si el latido caduca, la tarea vuelve a la cola
+    propietario = Column(String, nullable=True)
+    latido = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_tareas_estado_prioridad", "estado", "prioridad", "ejecutar_desde"),
+        # Solo puede haber una tarea pendiente con la misma clave
+        Index("ux_tareas_clave_pendiente", "clave", unique=True, sqlite_where=text("estado = 'pendiente'")),
+    )
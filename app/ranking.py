@@ -0,0 +1,266 @@
+import json
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+
+from app.catalogo import NUMERICA, a_numero, codigo_pregunta, obtener_catalogo
+from app.database import avanzar_version, version_datos
+
+NIVEL = "nivel_digitalizacion"  # Pseudo-pregunta con el nivel calculado
+_CODIGO_RESPUESTA = re.compile(r"^\s*(\d+)\s*\.")
+
+
+def _vacio(valor):
+    return valor is None or str(valor).strip() in ("", "nan")
+
+
+def _codigo_respuesta(valor):
+    """'2. No' -> 2. Las respuestas sin código no tienen orden."""
+    match = _CODIGO_RESPUESTA.match(str(valor))
+    return int(match.group(1)) if match else None
+
+
+class _GrupoPares:
+    """Valores ordenados y conteos de una pregunta dentro de un grupo de municipios."""
+
+    def __init__(self):
+        self.ordenados = []  # valores numéricos o códigos de respuesta
+        self.conteos = Counter()  # solo preguntas categóricas
+
+    def anadir(self, clave_orden, etiqueta):
+        if clave_orden is not None:
+            insort(self.ordenados, clave_orden)
+        if etiqueta is not None:
+            self.conteos[etiqueta] += 1
+
+    def quitar(self, clave_orden, etiqueta):
+        if clave_orden is not None:
+            i = bisect_left(self.ordenados, clave_orden)
+            if i < len(self.ordenados) and self.ordenados[i] == clave_orden:
+                del self.ordenados[i]
+        if etiqueta is not None:
+            self.conteos[etiqueta] -= 1
+            if self.conteos[etiqueta] <= 0:
+                del self.conteos[etiqueta]
+
+    def cuantil(self, q):
+        # Cuantil por el método del rango más cercano, sin recorrer el array
+        n = len(self.ordenados)
+        return self.ordenados[min(n - 1, int(q * (n - 1) + 0.5))]
+
+
+class IndiceComparativa:
+    """
+    Compara un municipio con sus pares para cualquier pregunta.
+
+    Por cada (pregunta, grupo de pares) se mantiene un array ordenado, así que el
+    rango y el percentil se obtienen con una búsqueda binaria. Los arrays se crean la
+    primera vez que se piden y después se actualizan de forma incremental.
+
+    - Preguntas numéricas: mayor valor = mejor posición.
+    - Preguntas categóricas: se ordena por el código de la respuesta ('1. Sí' antes que '2. No').
+    """
+
+    def __init__(self, respuestas, niveles=None, tipos=None):
+        # respuestas: {clave_municipio: {pregunta: valor}}
+        # tipos: {pregunta: tipo} del catálogo; sin tipo se deduce de las respuestas
+        self.respuestas = {clave: dict(r) for clave, r in respuestas.items()}
+        for clave, nivel in (niveles or {}).items():
+            self.respuestas.setdefault(clave, {})[NIVEL] = nivel
+        self._numericas = {p: tipo == NUMERICA for p, tipo in (tipos or {}).items()}
+        self._numericas[NIVEL] = True
+        self._grupos = {}  # (pregunta, pregunta_grupo, valor_grupo) -> _GrupoPares
+        self._lock = threading.Lock()
+        # Columnas con alguna respuesta y su código ('P8'): se mantienen al actualizar
+        self._columnas = set()
+        self._por_codigo = {}
+        for r in self.respuestas.values():
+            self._registrar_columnas(r)
+        self.version = None  # firma de los datos de la BD con los que está al día (version_datos)
+
+    # -----------------------------------------------------
+    # Utilidades
+    # -----------------------------------------------------
+    def _registrar_columnas(self, columnas):
+        for columna in columnas:
+            if columna not in self._columnas:
+                self._columnas.add(columna)
+                codigo = codigo_pregunta(columna)
+                if codigo:
+                    self._por_codigo.setdefault(codigo, columna)
+
+    def preguntas(self):
+        return sorted(self._columnas)
+
+    def resolver_pregunta(self, pregunta):
+        """Acepta el nombre exacto de la columna, su id del catálogo o su código ('P8')."""
+        if pregunta in self._columnas:
+            return pregunta
+        try:
+            p = obtener_catalogo().pregunta(pregunta)
+            if p and p.columna in self._columnas:
+                return p.columna
+        except Exception:
+            pass
+        codigo = codigo_pregunta(pregunta)
+        return self._por_codigo.get(codigo) if codigo else None
+
+    def es_numerica(self, pregunta):
+        if pregunta not in self._numericas:
+            valores = [r[pregunta] for r in self.respuestas.values() if not _vacio(r.get(pregunta))]
+            self._numericas[pregunta] = bool(valores) and all(a_numero(v) is not None for v in valores)
+        return self._numericas[pregunta]
+
+    def _claves(self, pregunta, valor):
+        """Devuelve (clave de orden, etiqueta de categoría) de una respuesta."""
+        if _vacio(valor):
+            return None, None
+        if self.es_numerica(pregunta):
+            return a_numero(valor), None
+        etiqueta = str(valor).strip()
+        return _codigo_respuesta(etiqueta), etiqueta
+
+    def _valor_grupo(self, clave, grupo):
+        if grupo is None:
+            return None
+        valor = self.respuestas.get(clave, {}).get(grupo)
+        return None if _vacio(valor) else str(valor).strip()
+
+    def _grupo(self, pregunta, grupo, valor_grupo):
+        clave_grupo = (pregunta, grupo, valor_grupo)
+        pares = self._grupos.get(clave_grupo)
+        if pares is None:
+            pares = _GrupoPares()
+            for clave in self.respuestas:
+                if self._valor_grupo(clave, grupo) == valor_grupo:
+                    pares.anadir(*self._claves(pregunta, self.respuestas[clave].get(pregunta)))
+            self._grupos[clave_grupo] = pares
+        return pares
+
+    # -----------------------------------------------------
+    # Consulta
+    # -----------------------------------------------------
+    def comparar(self, clave, pregunta, grupo=None):
+        """Rango, percentil y distribución de los pares de un municipio para una pregunta."""
+        with self._lock:
+            valor = self.respuestas.get(clave, {}).get(pregunta)
+            valor_grupo = self._valor_grupo(clave, grupo)
+            pares = self._grupo(pregunta, grupo, valor_grupo)
+            orden, etiqueta = self._claves(pregunta, valor)
+            n = len(pares.ordenados)
+
+            resultado = {
+                "pregunta": pregunta,
+                "tipo": "numerica" if self.es_numerica(pregunta) else "categorica",
+                "valor": None if _vacio(valor) else valor,
+                "grupo": {"pregunta": grupo, "valor": valor_grupo} if grupo else None,
+                "pares": n if self.es_numerica(pregunta) else sum(pares.conteos.values()),
+                "rango": None,
+                "percentil": None,
+            }
+
+            if orden is not None and n:
+                menores = bisect_left(pares.ordenados, orden)
+                mayores = n - bisect_right(pares.ordenados, orden)
+                empates = n - menores - mayores
+                if self.es_numerica(pregunta):
+                    resultado["rango"] = mayores + 1
+                    resultado["percentil"] = round(100.0 * (menores + empates / 2) / n, 2)
+                else:
+                    resultado["rango"] = menores + 1
+                    resultado["percentil"] = round(100.0 * (mayores + empates / 2) / n, 2)
+
+            if self.es_numerica(pregunta):
+                resultado["distribucion"] = {
+                    "min": pares.ordenados[0],
+                    "p25": pares.cuantil(0.25),
+                    "mediana": pares.cuantil(0.5),
+                    "p75": pares.cuantil(0.75),
+                    "max": pares.ordenados[-1],
+                } if n else {}
+            else:
+                resultado["distribucion"] = dict(pares.conteos.most_common())
+                resultado["mismo_valor"] = pares.conteos.get(etiqueta, 0) if etiqueta else 0
+            return resultado
+
+    # -----------------------------------------------------
+    # Actualización incremental
+    # -----------------------------------------------------
+    def actualizar(self, clave, respuestas, nivel=None, version_subida=True):
+        """
+        Aplica las respuestas nuevas de un municipio a los arrays ya calculados.
+        'version_subida': el guardado que se aplica ha subido la versión de su fila en la BD.
+        """
+        nuevas = dict(respuestas)
+        if nivel is not None:
+            nuevas[NIVEL] = nivel
+
+        with self._lock:
+            if version_subida:
+                self.version = avanzar_version(self.version)
+            anteriores = self.respuestas.setdefault(clave, {})
+            cambios = {p: v for p, v in nuevas.items() if anteriores.get(p) != v}
+            if not cambios:
+                return
+            self._registrar_columnas(cambios)
+
+            # Si cambia una pregunta usada para agrupar, el municipio cambia de grupo:
+            # esos grupos se descartan y se recalcularán cuando se pidan.
+            for clave_grupo in [k for k in self._grupos if k[1] in cambios]:
+                del self._grupos[clave_grupo]
+
+            for (pregunta, grupo, valor_grupo), pares in self._grupos.items():
+                if pregunta in cambios and self._valor_grupo(clave, grupo) == valor_grupo:
+                    pares.quitar(*self._claves(pregunta, anteriores.get(pregunta)))
+                    pares.anadir(*self._claves(pregunta, cambios[pregunta]))
+
+            # Un valor no numérico convierte la pregunta en categórica
+            for pregunta, valor in cambios.items():
+                if self._numericas.get(pregunta) and not _vacio(valor) and a_numero(valor) is None:
+                    self._numericas.pop(pregunta)
+                    for clave_grupo in [k for k in self._grupos if k[0] == pregunta]:
+                        del self._grupos[clave_grupo]
+
+            anteriores.update(cambios)
+
+
+def indice_desde_db(db):
+    from app.models import DatosAyuntamiento
+
+    respuestas, niveles = {}, {}
+    for ayto_id, data_json, nivel in db.query(
+        DatosAyuntamiento.ayto_id, DatosAyuntamiento.data_json, DatosAyuntamiento.nivel_digitalizacion
+    ):
+        try:
+            respuestas[ayto_id] = json.loads(data_json) if data_json else {}
+        except Exception:
+            respuestas[ayto_id] = {}
+        if nivel is not None:
+            niveles[ayto_id] = nivel
+    tipos = {}
+    try:
+        tipos = obtener_catalogo().tipos()
+    except Exception as e:
+        print(f"⚠️ No se pudo cargar el catálogo de preguntas: {e}")
+    return IndiceComparativa(respuestas, niveles, tipos)
+
+
+# Un índice por proceso y base de datos (región): se construye la primera vez que se usa y
+# se vuelve a construir si los datos han cambiado fuera de este proceso (sincronización,
+# ingesta, otro worker)
+_indices = {}
+_indice_lock = threading.Lock()
+
+
+def obtener_indice(db):
+    clave = str(db.get_bind().url)
+    version = version_datos(db)
+    with _indice_lock:
+        indice = _indices.get(clave)
+        if indice is None or indice.version != version:
+            if indice is not None:
+                print("🔄 Los datos han cambiado fuera de este proceso: se reconstruye el índice de comparativa.")
+            indice = _indices[clave] = indice_desde_db(db)
+            indice.version = version
+        return indice
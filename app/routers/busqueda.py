@@ -0,0 +1,15 @@
+# app/routers/busqueda.py
+from fastapi import APIRouter, Query
+from app.busqueda import buscar_en_regiones
+
+router = APIRouter()
+
+
+@router.get("/api/buscar")
+def buscar_texto(
+    q: str = "",
+    pagina: int = Query(1, ge=1),
+    por_pagina: int = Query(20, ge=1, le=100),
+):
+    """Busca en las notas y respuestas de texto libre de todos los municipios de todas las regiones (sin distinguir acentos)."""
+    return buscar_en_regiones(q, pagina, por_pagina)
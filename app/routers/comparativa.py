@@ -0,0 +1,34 @@
+# app/routers/comparativa.py
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.models import Ayuntamiento
+from app.ranking import obtener_indice
+from app.shards import sesion_municipio
+
+router = APIRouter()
+
+
+@router.get("/api/comparativa/{codigo}")
+def comparativa(codigo: str, pregunta: str = "nivel_digitalizacion", grupo: str = None, db: Session = Depends(sesion_municipio)):
+    """
+    Posición de un municipio frente a sus pares (de su misma región) para una pregunta.
+    'grupo' es opcional: otra pregunta cuyo valor define los pares (p. ej. 'P57').
+    """
+    ayto = db.query(Ayuntamiento).filter_by(codigo=codigo).first()
+    if not ayto:
+        raise HTTPException(status_code=404, detail="Municipio no encontrado")
+
+    indice = obtener_indice(db)
+    columna = indice.resolver_pregunta(pregunta)
+    if not columna:
+        raise HTTPException(status_code=404, detail=f"Pregunta '{pregunta}' no encontrada")
+
+    columna_grupo = None
+    if grupo:
+        columna_grupo = indice.resolver_pregunta(grupo)
+        if not columna_grupo:
+            raise HTTPException(status_code=404, detail=f"Pregunta de grupo '{grupo}' no encontrada")
+
+    resultado = indice.comparar(ayto.id, columna, columna_grupo)
+    resultado["municipio"] = {"codigo": ayto.codigo, "nombre": ayto.nombre}
+    return resultado
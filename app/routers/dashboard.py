@@ -3,7 +3,10 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from app.database import SessionLocal
 from app.models import Ayuntamiento, DatosAyuntamiento
-import pandas as pd
+from app.catalogo import EXCEL_PATH, obtener_catalogo
+from app.busqueda import indexar_municipio
+from app.tareas import PRIORIDAD_ALTA, encolar
+import json
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -45,13 +48,14 @@ def update_data(
     datos.p2 = p2
     datos.p3 = p3
     datos.notas = notas
+    indexar_municipio(db, datos.ayto_id, json.loads(datos.data_json or "{}"), notas)
     db.commit()
 
-    # Sincronizar también con el Excel
-    df = pd.read_excel("data/ENCUESTAS_datosIA.xlsx")
-    mask = df["Municipio"].str.lower() == ayto.nombre.lower()
-    df.loc[mask, ["P1. Formación", "P2. Infraestructura", "P3. Servicios"]] = [p1, p2, p3]
-    df.to_excel("data/ENCUESTAS_datosIA.xlsx", index=False)
+    # Sincronizar también con el Excel: reescribirlo es lento, lo hace el planificador de tareas
+    catalogo = obtener_catalogo(EXCEL_PATH)
+    columnas = [catalogo.pregunta(id_pregunta).columna for id_pregunta in ("P1", "P2", "P3")]
+    parametros = {"codigo": ayto.codigo, "municipio": ayto.nombre, "cambios": dict(zip(columnas, [p1, p2, p3]))}
+    encolar(db, "escribir_excel", parametros, PRIORIDAD_ALTA)
 
     db.close()
     return RedirectResponse(url="/data-input", status_code=303)
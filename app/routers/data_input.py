@@ -5,7 +5,10 @@ from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from app.database import SessionLocal
 from app.models import Ayuntamiento, DatosAyuntamiento
-from app.excel_utils import COLUMNAS_P # 👈 1. Importamos la lista de columnas
+from app.excel_utils import columnas_editables # 👈 1. Lista de columnas (se carga una vez)
+from app.scoring import obtener_motor
+from app.ranking import obtener_indice
+from app.concurrencia import ConflictoEdicion, guardar_respuestas
 import pandas as pd
 import json
 
@@ -40,8 +43,8 @@ def get_data_input(request: Request):
         db.refresh(datos)
 
   # leer Excel para obtener lista de columnas P* - ELIMINADO
-  # Ahora usamos la lista cargada al inicio
-    p_columns = COLUMNAS_P
+  # Ahora usamos la lista cargada en el arranque
+    p_columns = columnas_editables()
 
   # cargar JSON actual (si lo hay)
     current = {}
@@ -60,6 +63,7 @@ def get_data_input(request: Request):
         "nivel_digitalizacion": datos.nivel_digitalizacion if datos.nivel_digitalizacion is not None else "Sin definir",
         "p_columns": p_columns, # 👈 Usamos la lista cargada
         "current": current,
+        "version": datos.version,  # se devuelve al guardar para detectar ediciones simultáneas
         "msg": request.query_params.get("msg") # Leer mensaje si viene de un redirect
     }
     db.close()
@@ -75,6 +79,7 @@ def post_data_input(
     val2: str = Form(""),
     col3: str = Form(None),
     val3: str = Form(""),
+    version: str = Form(""),
 ):
     db = SessionLocal()
     ayto = get_current_ayto(request, db)
@@ -82,51 +87,54 @@ def post_data_input(
         db.close()
         return RedirectResponse(url="/login", status_code=303)
 
-    # obtener o crear registro datos
-    datos = db.query(DatosAyuntamiento).filter_by(ayto_id=ayto.id).first()
-    if not datos:
-        datos = DatosAyuntamiento(ayto_id=ayto.id, data_json="{}")
-        db.add(datos)
-        db.commit()
-        db.refresh(datos)
-
-    # actualizar JSON local
-    current = {}
+    # 1. Valores enviados en el formulario
+    nuevos = {}
+    for col, val in ((col1, val1), (col2, val2), (col3, val3)):
+        if col:
+            nuevos[col] = val
+
+    # 2. Guardar con control de versión: si otro usuario ha cambiado las mismas
+    #    preguntas desde que se abrió el formulario, no se pisan sus respuestas.
+    #    El historial de cambios se guarda en la misma transacción.
+    # El motor y el índice se piden antes de guardar (el guardado los deja al día)
+    motor, indice = obtener_motor(db), obtener_indice(db)
     try:
-        current = json.loads(datos.data_json) if datos.data_json else {}
-    except Exception:
-        current = {}
-
-    # 1. Aplicar los nuevos valores
-    if col1:
-        current[col1] = val1
-    if col2:
-        current[col2] = val2
-    if col3:
-        current[col3] = val3
+        datos, current, nivel, version_subida = guardar_respuestas(
+            db,
+            ayto,
+            nuevos,
+            version_base=int(version) if version.isdigit() else None,
+            autor=ayto.codigo,
+            calcular_nivel=motor.calcular_nivel,
+        )
+    except ConflictoEdicion as e:
+        datos = db.query(DatosAyuntamiento).filter_by(ayto_id=ayto.id).first()
+        current = json.loads(datos.data_json) if datos and datos.data_json else {}
+        detalle = "; ".join(
+            f"{c['pregunta']}: ahora vale {c['actual']!r} ({c['autor'] or 'otro usuario'})"
+            for c in e.conflictos
+        )
+        contexto = {
+            "request": request,
+            "ayto": ayto,
+            "col1_name": col1,
+            "nivel_digitalizacion": datos.nivel_digitalizacion if datos and datos.nivel_digitalizacion is not None else "Sin definir",
+            "p_columns": columnas_editables(),
+            "current": current,
+            "version": datos.version if datos else None,
+            "msg": f"{e}. {detalle}. Revisa los valores y vuelve a guardar." if detalle else str(e),
+            "conflicto": True,
+        }
+        db.close()
+        return templates.TemplateResponse("data_input.html", contexto, status_code=409)
 
-    # 2. Guardar JSON en BD
-    datos.data_json = json.dumps(current, ensure_ascii=False)
-    
-    # 3. Actualizar nivel_digitalizacion si se ha modificado la columna "Nivel de digitalización (%)"
-    # Se usa 'Nivel de digitalización (%)' para que sea más fácil de identificar.
-    NIVEL_COL = "Nivel de digitalización (%)"
-    if NIVEL_COL in current:
-        try:
-            datos.nivel_digitalizacion = float(current.get(NIVEL_COL) or datos.nivel_digitalizacion)
-        except Exception:
-        # Si falla la conversión a float, no hacemos nada y dejamos el valor anterior
-            pass
-        
-    db.commit()
-  
-  # ----------------------------------------------------
-  # 4. 🔥 ELIMINAR EL CÓDIGO INSEGURO DE REESCRITURA DEL EXCEL
-  #    Tu base de datos (SQLite) es ahora la única fuente de la verdad.
-  # ----------------------------------------------------
+    # 3. Con el cambio ya confirmado, actualizar el motor de puntuación (solo la fila
+    #    de este municipio) y los arrays de la comparativa con otros municipios
+    motor.actualizar_respuestas(ayto.id, current, version_subida)
+    indice.actualizar(ayto.id, current, datos.nivel_digitalizacion, version_subida)
 
     db.close()
 
-    # 5. Redirigir para evitar que el usuario vuelva a enviar el formulario.
+    # 4. Redirigir para evitar que el usuario vuelva a enviar el formulario.
     #    Pasamos un mensaje de éxito por URL.
     return RedirectResponse(url="/data-input?msg=Datos guardados correctamente", status_code=303)
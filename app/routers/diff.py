@@ -0,0 +1,40 @@
+# app/routers/diff.py
+import os
+from fastapi import APIRouter, HTTPException
+from app.catalogo import EXCEL_PATH
+from app.diff_excel import dataframe_desde_db, diferencias, leer_excel
+from app.shards import REGION_POR_DEFECTO, obtener_router
+
+router = APIRouter()
+DATA_DIR = os.path.dirname(EXCEL_PATH)
+
+
+def _ruta_excel(nombre):
+    # Solo se permiten ficheros .xlsx de la carpeta data (sin rutas)
+    if os.path.basename(nombre) != nombre or not nombre.endswith(".xlsx"):
+        raise HTTPException(status_code=400, detail=f"Nombre de fichero no válido: {nombre}")
+    ruta = os.path.join(DATA_DIR, nombre)
+    if not os.path.exists(ruta):
+        raise HTTPException(status_code=404, detail=f"No existe el fichero {nombre}")
+    return ruta
+
+
+@router.get("/api/diff/excel")
+def diff_excel(antes: str, despues: str = os.path.basename(EXCEL_PATH)):
+    """Cambios celda a celda entre dos Excel de la carpeta data."""
+    return diferencias(leer_excel(_ruta_excel(antes)), leer_excel(_ruta_excel(despues)))
+
+
+@router.get("/api/diff/db")
+def diff_db(region: str = REGION_POR_DEFECTO, excel: str = None):
+    """
+    Vista previa de una resincronización: qué cambiaría en la BD de la región si se cargara
+    el Excel (por defecto, el de esa región).
+    """
+    regiones = obtener_router()
+    if region not in regiones.regiones:
+        raise HTTPException(status_code=404, detail=f"Región desconocida: {region}")
+    ruta = _ruta_excel(excel) if excel else regiones.excel(region)
+    with regiones.sesion(region) as db:
+        desde_db = dataframe_desde_db(db)
+    return diferencias(desde_db, leer_excel(ruta))
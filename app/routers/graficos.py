@@ -0,0 +1,39 @@
+# app/routers/graficos.py
+from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
+from app.catalogo import EXCEL_PATH, obtener_catalogo
+from app.dataset import obtener_dataset
+from app.graficos import MAX_CATEGORIAS, TIPOS, cache_graficos
+
+router = APIRouter()
+
+
+@router.get("/api/graficos/{pregunta}")
+def grafico(
+    pregunta: str,
+    tipo: str = None,
+    filtro: List[str] = Query(default=[]),
+    max_categorias: int = Query(MAX_CATEGORIAS, ge=2, le=100),
+):
+    """
+    Figura de Plotly (JSON) de cualquier pregunta, lista para Plotly.newPlot / st.plotly_chart.
+    'filtro' se repite con la forma pregunta=valor, p. ej. ?filtro=P57=1. Sí
+    """
+    catalogo = obtener_catalogo(EXCEL_PATH)
+    encontrada = catalogo.pregunta(pregunta)
+    if encontrada is None:
+        raise HTTPException(status_code=404, detail=f"Pregunta '{pregunta}' no encontrada")
+    if tipo and tipo not in TIPOS:
+        raise HTTPException(status_code=400, detail=f"Tipo de gráfico no válido. Opciones: {', '.join(TIPOS)}")
+
+    filtros = {}
+    for f in filtro:
+        clave, _, valor = f.partition("=")
+        columna = catalogo.pregunta(clave)
+        if columna is None or not valor:
+            raise HTTPException(status_code=400, detail=f"Filtro no válido: '{f}'")
+        filtros.setdefault(columna.columna, []).append(valor.strip())
+
+    figura = cache_graficos.obtener(obtener_dataset(EXCEL_PATH), encontrada, tipo, filtros, max_categorias=max_categorias)
+    return Response(content=figura, media_type="application/json")
@@ -0,0 +1,72 @@
+# app/routers/historial.py
+import json
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.models import Ayuntamiento, CambioRespuesta
+from app.historial import encuesta_en, estado_en
+from app.shards import obtener_router, sesion_municipio
+
+router = APIRouter()
+
+
+def _get_ayto(db, codigo):
+    ayto = db.query(Ayuntamiento).filter_by(codigo=codigo).first()
+    if not ayto:
+        raise HTTPException(status_code=404, detail="Municipio no encontrado")
+    return ayto
+
+
+@router.get("/api/historial")
+def historial_encuesta(fecha: datetime = None):
+    """La encuesta completa (todos los municipios de todas las regiones) tal y como estaba en 'fecha'. Sin fecha: estado actual."""
+
+    def encuesta_region(region, db):
+        estados = encuesta_en(db, fecha)
+        aytos = db.query(Ayuntamiento).filter(Ayuntamiento.id.in_(list(estados)))
+        return [
+            {"codigo": a.codigo, "nombre": a.nombre, "region": region, "respuestas": estados[a.id]}
+            for a in aytos
+        ]
+
+    por_region = obtener_router().en_paralelo(encuesta_region)
+    return {
+        "fecha": fecha,
+        "municipios": sorted(
+            (m for municipios in por_region.values() for m in municipios), key=lambda m: m["nombre"]
+        ),
+    }
+
+
+@router.get("/api/historial/{codigo}")
+def historial_estado(codigo: str, fecha: datetime = None, db: Session = Depends(sesion_municipio)):
+    """Respuestas del municipio tal y como estaban en 'fecha' (UTC, ISO 8601). Sin fecha: estado actual."""
+    ayto = _get_ayto(db, codigo)
+    return {
+        "municipio": {"codigo": ayto.codigo, "nombre": ayto.nombre},
+        "fecha": fecha,
+        "respuestas": estado_en(db, ayto.id, fecha),
+    }
+
+
+@router.get("/api/historial/{codigo}/cambios")
+def historial_cambios(codigo: str, desde: datetime = None, hasta: datetime = None, limite: int = 100, db: Session = Depends(sesion_municipio)):
+    """Últimos cambios de respuestas del municipio, del más reciente al más antiguo."""
+    ayto = _get_ayto(db, codigo)
+    consulta = db.query(CambioRespuesta).filter(CambioRespuesta.ayto_id == ayto.id)
+    if desde:
+        consulta = consulta.filter(CambioRespuesta.fecha >= desde)
+    if hasta:
+        consulta = consulta.filter(CambioRespuesta.fecha <= hasta)
+    eventos = consulta.order_by(CambioRespuesta.id.desc()).limit(min(limite, 1000))
+    return [
+        {
+            "id": e.id,
+            "pregunta": e.pregunta,
+            "valor_anterior": json.loads(e.valor_anterior) if e.valor_anterior else None,
+            "valor_nuevo": json.loads(e.valor_nuevo) if e.valor_nuevo else None,
+            "fecha": e.fecha,
+            "autor": e.autor,
+        }
+        for e in eventos
+    ]
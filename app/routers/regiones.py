@@ -0,0 +1,26 @@
+# app/routers/regiones.py
+from fastapi import APIRouter, HTTPException
+from app.shards import obtener_router, resumen_regiones
+
+router = APIRouter()
+
+
+@router.get("/api/regiones")
+def listar_regiones():
+    """Regiones configuradas y el Excel de cada una."""
+    regiones = obtener_router()
+    return {region: {"excel": regiones.excel(region)} for region in regiones.regiones}
+
+
+@router.get("/api/regiones/resumen")
+def resumen():
+    """Nivel de digitalización por región y total; cada región se consulta en paralelo."""
+    return resumen_regiones()
+
+
+@router.get("/api/regiones/municipio/{codigo}")
+def region_municipio(codigo: str):
+    region = obtener_router().region_de(codigo)
+    if region is None:
+        raise HTTPException(status_code=404, detail="Municipio no encontrado en ninguna región")
+    return {"codigo": codigo, "region": region}
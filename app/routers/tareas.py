@@ -0,0 +1,59 @@
+# app/routers/tareas.py
+from fastapi import APIRouter, Body, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models import Tarea
+from app.shards import obtener_router
+from app.tareas import MANEJADORES, PRIORIDAD_NORMAL, encolar, regiones_tarea, tarea_a_dict
+
+router = APIRouter()
+
+# 'escribir_excel' solo se encola desde el formulario de datos, con el municipio de la sesión
+SOLO_INTERNAS = {"escribir_excel"}
+
+
+@router.get("/api/tareas")
+def listar_tareas(estado: str = None, tipo: str = None, limite: int = 50, db: Session = Depends(get_db)):
+    """Tareas más recientes (opcionalmente filtradas por estado o tipo)."""
+    consulta = db.query(Tarea)
+    if estado:
+        consulta = consulta.filter(Tarea.estado == estado)
+    if tipo:
+        consulta = consulta.filter(Tarea.tipo == tipo)
+    return [tarea_a_dict(t) for t in consulta.order_by(Tarea.id.desc()).limit(min(limite, 500))]
+
+
+@router.get("/api/tareas/{tarea_id}")
+def ver_tarea(tarea_id: int, db: Session = Depends(get_db)):
+    """Estado y progreso de una tarea."""
+    tarea = db.get(Tarea, tarea_id)
+    if not tarea:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    return tarea_a_dict(tarea)
+
+
+@router.post("/api/tareas/{tipo}", status_code=202)
+def crear_tarea(
+    tipo: str,
+    request: Request,
+    parametros: dict = Body(default={}),
+    prioridad: int = PRIORIDAD_NORMAL,
+    db: Session = Depends(get_db),
+):
+    """
+    Encola una tarea ('conciliar', 'exportar_excel', 'compactar_historial'). Requiere sesión.
+    Con 'region' en los parámetros trabaja solo sobre esa región; si no, sobre todas.
+    Si ya hay una pendiente idéntica se devuelve esa.
+    """
+    codigo = request.cookies.get("codigo")
+    if not codigo or obtener_router().region_de(codigo) is None:
+        raise HTTPException(status_code=401, detail="Es necesario iniciar sesión")
+    if tipo not in MANEJADORES or tipo in SOLO_INTERNAS:
+        raise HTTPException(status_code=404, detail=f"Tipo de tarea '{tipo}' desconocido")
+
+    # Cada región trabaja con su base de datos y su Excel: solo se elige la región
+    try:
+        regiones_tarea(parametros)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return tarea_a_dict(encolar(db, tipo, parametros, prioridad))
@@ -0,0 +1,215 @@
+import json
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from app.catalogo import EXCEL_PATH, PREFIJO_PONDER, codigo_pregunta
+from app.database import avanzar_version, version_datos
+
+# -----------------------------------------------------
+# CONFIGURACIÓN
+# -----------------------------------------------------
+# Los pesos de cada pregunta se leen de las columnas PONDER* del Excel
+PESO_POR_DEFECTO = 1.0
+
+# Puntuación de cada tipo de respuesta (se compara el texto sin el código "1. ", "2. "...).
+# Las reglas se comparan por palabras completas al inicio del texto ("SIR" o "Notificaciones"
+# no son un sí o un no) y el orden importa: se usa la primera regla que coincida, por eso
+# las formas de no sabe / no aplica van antes que el "no".
+# None significa que la respuesta no puntúa (no sabe / no aplica) y no cuenta en el total.
+ESCALA_RESPUESTAS = [
+    (r"no (sé|se|sabe|saben|aplica)\b", None),
+    (r"no tengo\b", None),
+    (r"no tienen este servicio\b", None),
+    (r"no es necesaria\b", None),
+    (r"uso un programa que no es especifico\b", 0.5),
+    (r"(sí|si)\b", 1.0),
+    (r"no\b", 0.0),
+]
+_REGLAS = [(re.compile(patron), puntos) for patron, puntos in ESCALA_RESPUESTAS]
+
+_CODIGO_RESPUESTA = re.compile(r"^\s*\d+\s*\.\s*")
+
+
+def puntuar_respuesta(valor):
+    """Convierte una respuesta del Excel en una puntuación entre 0 y 1 (NaN si no puntúa)."""
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return np.nan
+
+    texto = _CODIGO_RESPUESTA.sub("", str(valor)).strip().lower()
+    if not texto:
+        return np.nan
+
+    for regla, puntos in _REGLAS:
+        if regla.match(texto):
+            return np.nan if puntos is None else puntos
+    return np.nan
+
+
+def cargar_pesos(df):
+    """
+    Lee los pesos de las columnas PONDER* del Excel.
+    'PONDER P8' (o 'PONDER_P8. Fibra Optica') asigna a la pregunta P8 el primer valor numérico de la columna.
+    """
+    pesos_por_codigo = {}
+    for col in df.columns:
+        nombre = str(col).strip()
+        if not nombre.upper().startswith(PREFIJO_PONDER):
+            continue
+        codigo = codigo_pregunta(nombre[len(PREFIJO_PONDER):].lstrip(" _-:"))
+        valores = pd.to_numeric(df[col], errors="coerce").dropna()
+        if codigo and not valores.empty:
+            pesos_por_codigo[codigo] = float(valores.iloc[0])
+
+    pesos = {}
+    for col in df.columns:
+        nombre = str(col).strip()
+        codigo = codigo_pregunta(nombre)
+        if codigo in pesos_por_codigo and not nombre.upper().startswith(PREFIJO_PONDER):
+            pesos[nombre] = pesos_por_codigo[codigo]
+    return pesos
+
+
+def _puntuar_matriz(valores):
+    """Puntúa una matriz de respuestas evaluando cada respuesta distinta una sola vez."""
+    codigos, unicos = pd.factorize(valores.ravel(), use_na_sentinel=True)
+    puntos_unicos = np.array([puntuar_respuesta(v) for v in unicos] + [np.nan], dtype=float)
+    # El código -1 (NaN) apunta al último elemento, que es NaN
+    return puntos_unicos[codigos].reshape(valores.shape)
+
+
+class MotorPuntuacion:
+    """
+    Calcula el nivel de digitalización (0-100) de todos los municipios en una sola pasada de NumPy.
+
+    nivel = 100 * sum(peso * puntos) / sum(peso de las preguntas respondidas)
+
+    Cuando cambia una respuesta solo se recalcula la fila del municipio afectado.
+    """
+
+    def __init__(self, df, pesos=None):
+        pesos = pesos or {}
+        df = df.rename(columns=lambda c: str(c).strip())
+        columnas = [
+            c for c in df.columns
+            if codigo_pregunta(c) and not c.upper().startswith(PREFIJO_PONDER)
+        ]
+
+        matriz = _puntuar_matriz(df[columnas].to_numpy(dtype=object)) if columnas else np.empty((len(df), 0))
+
+        # Solo se puntúan las preguntas con alguna respuesta puntuable o con peso explícito
+        utiles = [
+            j for j, c in enumerate(columnas)
+            if c in pesos or not np.isnan(matriz[:, j]).all()
+        ]
+        self.columnas = [columnas[j] for j in utiles]
+        self.matriz = matriz[:, utiles]
+        self.pesos = np.array([pesos.get(c, PESO_POR_DEFECTO) for c in self.columnas], dtype=float)
+        self._pos_columna = {c: j for j, c in enumerate(self.columnas)}
+        self._fila = {clave: i for i, clave in enumerate(df.index)}
+        self._lock = threading.Lock()
+        self.version = None  # firma de los datos de la BD con los que está al día (version_datos)
+
+        self.niveles = self._calcular(self.matriz)
+
+    def _calcular(self, matriz):
+        respondidas = ~np.isnan(matriz)
+        numerador = np.where(respondidas, matriz, 0.0) @ self.pesos
+        denominador = respondidas @ self.pesos
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(denominador > 0, 100.0 * numerador / denominador, np.nan)
+
+    def nivel(self, clave):
+        """Nivel de digitalización de un municipio (None si no tiene respuestas puntuables)."""
+        i = self._fila.get(clave)
+        if i is None or np.isnan(self.niveles[i]):
+            return None
+        return round(float(self.niveles[i]), 2)
+
+    def calcular_nivel(self, respuestas):
+        """Nivel que tendría un municipio con estas respuestas, sin modificar el motor."""
+        fila = np.full((1, len(self.columnas)), np.nan)
+        for columna, valor in respuestas.items():
+            j = self._pos_columna.get(str(columna).strip())
+            if j is not None:
+                fila[0, j] = puntuar_respuesta(valor)
+        nivel = self._calcular(fila)[0]
+        return None if np.isnan(nivel) else round(float(nivel), 2)
+
+    def actualizar_respuestas(self, clave, respuestas, version_subida=True):
+        """
+        Aplica las respuestas nuevas de un municipio y recalcula solo su fila.
+        'version_subida': el guardado que se aplica ha subido la versión de su fila en la BD.
+        """
+        with self._lock:
+            if version_subida:
+                self.version = avanzar_version(self.version)
+            i = self._fila.get(clave)
+            if i is None:
+                i = len(self.niveles)
+                self._fila[clave] = i
+                self.matriz = np.vstack([self.matriz, np.full((1, len(self.columnas)), np.nan)])
+                self.niveles = np.append(self.niveles, np.nan)
+
+            for columna, valor in respuestas.items():
+                j = self._pos_columna.get(str(columna).strip())
+                if j is not None:
+                    self.matriz[i, j] = puntuar_respuesta(valor)
+
+            self.niveles[i] = self._calcular(self.matriz[i:i + 1])[0]
+        return self.nivel(clave)
+
+
+def motor_desde_db(db, pesos=None):
+    """Construye el motor con las respuestas guardadas en DatosAyuntamiento (clave: ayto_id)."""
+    from app.models import DatosAyuntamiento
+
+    registros = {}
+    for ayto_id, data_json in db.query(DatosAyuntamiento.ayto_id, DatosAyuntamiento.data_json):
+        try:
+            registros[ayto_id] = json.loads(data_json) if data_json else {}
+        except Exception:
+            registros[ayto_id] = {}
+    df = pd.DataFrame.from_dict(registros, orient="index")
+    return MotorPuntuacion(df, pesos)
+
+
+# Pesos del Excel por (ruta, mtime, tamaño): solo se vuelve a leer la hoja si cambia el fichero
+_pesos = {}
+
+
+def pesos_excel(path=EXCEL_PATH):
+    try:
+        estado = os.stat(path)
+        clave = (path, estado.st_mtime_ns, estado.st_size)
+        if clave not in _pesos:
+            # La hoja completa, igual que en sync_excel_to_db.py: un PONDER* puede tener
+            # la primera fila vacía y el peso en las siguientes
+            _pesos.clear()
+            _pesos[clave] = cargar_pesos(pd.read_excel(path, engine="openpyxl"))
+        return _pesos[clave]
+    except Exception as e:
+        print(f"⚠️ No se pudieron leer las ponderaciones del Excel: {e}")
+        return {}
+
+
+# Un motor por proceso y base de datos (región) que se actualiza fila a fila; se vuelve a
+# construir si los datos han cambiado fuera de este proceso (sincronización, ingesta, otro worker)
+_motores = {}
+_motor_lock = threading.Lock()
+
+
+def obtener_motor(db):
+    clave = str(db.get_bind().url)
+    version = version_datos(db)
+    with _motor_lock:
+        motor = _motores.get(clave)
+        if motor is None or motor.version != version:
+            if motor is not None:
+                print("🔄 Los datos han cambiado fuera de este proceso: se reconstruye el motor de puntuación.")
+            motor = _motores[clave] = motor_desde_db(db, pesos_excel())
+            motor.version = version
+        return motor
@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from app.catalogo import EXCEL_PATH
+from app.database import DATABASE_URL
+
+# -----------------------------------------------------
+# CONFIGURACIÓN
+# -----------------------------------------------------
+# Una base de datos (y un Excel) por región. Formato de data/shards.json:
+# {
+#   "regiones": {
+#     "alicante": {"url": "sqlite:///./data/ayuntamientos.db", "excel": "data/ENCUESTAS_datosIA.xlsx"},
+#     "valencia": {"url": "sqlite:///./data/valencia.db", "excel": "data/ENCUESTAS_valencia.xlsx"}
+#   },
+#   "municipios": {"algun_codigo": "valencia"}   # opcional: asignaciones explícitas
+# }
+# Sin fichero solo existe la región por defecto, que es la base de datos de siempre.
+SHARDS_PATH = "data/shards.json"
+REGION_POR_DEFECTO = "alicante"
+MAX_HILOS_CONSULTA = 8
+
+
+class RouterRegiones:
+    """
+    Reparte los municipios entre las bases de datos de cada región.
+
+    - Cada región tiene su motor y su sessionmaker, que se crean la primera vez que se usan.
+    - codigo -> región: asignación explícita del fichero o, si no la hay, se busca el código
+      en todas las regiones a la vez y el resultado queda en memoria.
+    - Las consultas agregadas se lanzan en paralelo, una por región.
+    """
+
+    def __init__(self, path=SHARDS_PATH):
+        self.regiones = {REGION_POR_DEFECTO: {"url": DATABASE_URL, "excel": EXCEL_PATH}}
+        self.asignaciones = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+            self.regiones = config.get("regiones") or self.regiones
+            self.asignaciones = dict(config.get("municipios", {}))
+        self._motores = {}
+        self._sesiones = {}
+        self._region_de = dict(self.asignaciones)
+        self._lock = threading.Lock()
+
+    def _config(self, region):
+        if region not in self.regiones:
+            raise KeyError(f"Región desconocida: {region}")
+        return self.regiones[region]
+
+    def excel(self, region):
+        return self._config(region).get("excel", EXCEL_PATH)
+
+    def engine(self, region):
+        """Motor de la región (se crea, con sus tablas, la primera vez que se pide)."""
+        with self._lock:
+            motor = self._motores.get(region)
+            if motor is None:
+                from app import models  # noqa: F401
+                from app.database import Base, SessionLocal, anadir_columnas_nuevas, engine, vigilar_fichero
+
+                url = self._config(region)["url"]
+                if url == DATABASE_URL:
+                    # La región de la base de datos de siempre comparte el motor de la aplicación
+                    motor, sesiones = engine, SessionLocal
+                    Base.metadata.create_all(bind=motor)
+                else:
+                    from app.busqueda import crear_indice, reconstruir_indice
+
+                    args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+                    motor = create_engine(url, connect_args=args)
+                    vigilar_fichero(motor, url)
+                    sesiones = sessionmaker(autocommit=False, autoflush=False, bind=motor)
+                    # Mismo esquema que prepara el arranque para la base de datos de siempre
+                    Base.metadata.create_all(bind=motor)
+                    anadir_columnas_nuevas(motor)
+                    if crear_indice(motor):
+                        with sesiones() as db:
+                            reconstruir_indice(db)
+                            db.commit()
+                self._motores[region] = motor
+                self._sesiones[region] = sesiones
+            return motor
+
+    def sesion(self, region):
+        self.engine(region)
+        return self._sesiones[region]()
+
+    def region_de(self, codigo):
+        """Región del municipio con ese código (None si no está en ninguna)."""
+        if codigo in self._region_de:
+            return self._region_de[codigo]
+
+        from app.models import Ayuntamiento
+
+        def buscar(region, db):
+            return db.query(Ayuntamiento.id).filter_by(codigo=codigo).first() is not None
+
+        encontrado = self.en_paralelo(buscar)
+        region = next((r for r in self.regiones if encontrado.get(r)), None)
+        if region is not None:
+            self._region_de[codigo] = region
+        return region
+
+    def sesion_para(self, codigo, region_nueva=REGION_POR_DEFECTO):
+        """Sesión de la base de datos del municipio (los municipios nuevos van a 'region_nueva')."""
+        return self.sesion(self.region_de(codigo) or region_nueva)
+
+    def en_paralelo(self, consulta, regiones=None):
+        """Ejecuta consulta(region, db) en cada región a la vez. Devuelve {region: resultado}."""
+        regiones = list(regiones or self.regiones)
+
+        def ejecutar(region):
+            db = self.sesion(region)
+            try:
+                return consulta(region, db)
+            finally:
+                db.close()
+
+        if len(regiones) == 1:
+            return {regiones[0]: ejecutar(regiones[0])}
+        with ThreadPoolExecutor(max_workers=min(MAX_HILOS_CONSULTA, len(regiones))) as pool:
+            return dict(zip(regiones, pool.map(ejecutar, regiones)))
+
+
+def _resumen_region(region, db):
+    from app.models import Ayuntamiento
+
+    total, con_nivel, suma, minimo, maximo = db.query(
+        func.count(Ayuntamiento.id),
+        func.count(Ayuntamiento.nivel_digitalizacion),
+        func.sum(Ayuntamiento.nivel_digitalizacion),
+        func.min(Ayuntamiento.nivel_digitalizacion),
+        func.max(Ayuntamiento.nivel_digitalizacion),
+    ).one()
+    return {
+        "municipios": total,
+        "con_nivel": con_nivel,
+        "suma": suma or 0.0,
+        "nivel_medio": round(suma / con_nivel, 2) if con_nivel else None,
+        "nivel_min": minimo,
+        "nivel_max": maximo,
+    }
+
+
+def resumen_regiones(router=None):
+    """Municipios y nivel de digitalización por región y en total (media ponderada)."""
+    router = router or obtener_router()
+    por_region = router.en_paralelo(_resumen_region)
+
+    con_nivel = sum(r["con_nivel"] for r in por_region.values())
+    suma = sum(r.pop("suma") for r in por_region.values())
+    minimos = [r["nivel_min"] for r in por_region.values() if r["nivel_min"] is not None]
+    maximos = [r["nivel_max"] for r in por_region.values() if r["nivel_max"] is not None]
+    return {
+        "regiones": por_region,
+        "total": {
+            "municipios": sum(r["municipios"] for r in por_region.values()),
+            "con_nivel": con_nivel,
+            "nivel_medio": round(suma / con_nivel, 2) if con_nivel else None,
+            "nivel_min": min(minimos) if minimos else None,
+            "nivel_max": max(maximos) if maximos else None,
+        },
+    }
+
+
+def sesion_municipio(codigo: str):
+    """Dependencia de FastAPI: sesión de la base de datos de la región del municipio {codigo}."""
+    db = obtener_router().sesion_para(codigo)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Un router por proceso: los motores y las conexiones se reutilizan entre peticiones
+_router = None
+_router_lock = threading.Lock()
+
+
+def obtener_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = RouterRegiones()
+            print(f"🗺️ Regiones configuradas: {', '.join(_router.regiones)}")
+        return _router
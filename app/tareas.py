@@ -0,0 +1,514 @@
+import json
+import os
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import and_, exists, func, or_, select, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
+
+from app.catalogo import MUNICIPIO_COL, a_numero
+from app.database import SessionLocal
+from app.models import Tarea, ahora
+from app.shards import REGION_POR_DEFECTO, obtener_router
+
+# -----------------------------------------------------
+# CONFIGURACIÓN
+# -----------------------------------------------------
+MAX_TRABAJADORES = 2  # tareas pesadas a la vez; el resto espera en la cola
+# Las tareas que reescriben el Excel van de una en una y en el orden en que se encolaron:
+# dos escrituras a la vez sobre el mismo fichero podrían aplicar la más antigua la última
+TAREAS_EXCEL = ("escribir_excel", "exportar_excel")
+INTERVALO_SONDEO = 2.0  # segundos entre consultas a la cola cuando no hay avisos
+INTERVALO_LATIDO = 10  # segundos entre latidos de las tareas en curso de un proceso
+CONCESION = 60  # segundos sin latido tras los que una tarea en curso se da por abandonada
+ESPERA_REINTENTO = 30  # segundos antes del primer reintento (se duplica en cada intento)
+
+PRIORIDAD_BAJA = 0
+PRIORIDAD_NORMAL = 5
+PRIORIDAD_ALTA = 10
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADA = "completada"
+FALLIDA = "fallida"
+
+# Tareas periódicas: (tipo, parámetros, hora UTC a la que se ejecutan cada día)
+PERIODICAS = [
+    ("conciliar", {"aplicar": False}, 2),
+    ("compactar_historial", {}, 3),
+]
+
+MANEJADORES = {}
+
+
+def manejador(tipo):
+    """Registra la función que ejecuta las tareas de un tipo: fn(db, parametros, progreso)."""
+    def registrar(fn):
+        MANEJADORES[tipo] = fn
+        return fn
+    return registrar
+
+
+def clave_tarea(tipo, parametros):
+    return f"{tipo}:{json.dumps(parametros or {}, sort_keys=True, ensure_ascii=False)}"
+
+
+def regiones_tarea(parametros):
+    """Regiones sobre las que trabaja la tarea: la indicada en 'region' o, si no se indica, todas."""
+    regiones = obtener_router().regiones
+    region = (parametros or {}).get("region")
+    if region is None:
+        return list(regiones)
+    if region not in regiones:
+        raise ValueError(f"Región desconocida: {region}")
+    return [region]
+
+
+def _por_region(parametros, progreso, fn):
+    """
+    Ejecuta fn(db, excel, progreso) en cada región de la tarea, una detrás de otra: cada región
+    se compara o se escribe con su propia base de datos y su propio Excel.
+    """
+    router = obtener_router()
+    regiones = regiones_tarea(parametros)
+    resultados = {}
+    for i, region in enumerate(regiones):
+        def progreso_region(fraccion, mensaje=None, i=i, region=region):
+            progreso((i + fraccion) / len(regiones), f"{region}: {mensaje}" if mensaje else region)
+
+        with router.sesion(region) as db:
+            resultados[region] = fn(db, router.excel(region), progreso_region)
+    return {"regiones": resultados}
+
+
+def tarea_a_dict(tarea):
+    return {
+        "id": tarea.id,
+        "tipo": tarea.tipo,
+        "parametros": json.loads(tarea.parametros) if tarea.parametros else {},
+        "prioridad": tarea.prioridad,
+        "estado": tarea.estado,
+        "progreso": round(tarea.progreso or 0.0, 3),
+        "mensaje": tarea.mensaje,
+        "resultado": json.loads(tarea.resultado) if tarea.resultado else None,
+        "intentos": tarea.intentos,
+        "max_intentos": tarea.max_intentos,
+        "ejecutar_desde": tarea.ejecutar_desde,
+        "creada": tarea.creada,
+        "iniciada": tarea.iniciada,
+        "terminada": tarea.terminada,
+        "propietario": tarea.propietario,
+        "latido": tarea.latido,
+    }
+
+
+def encolar(db, tipo, parametros=None, prioridad=PRIORIDAD_NORMAL, ejecutar_desde=None, max_intentos=3):
+    """
+    Añade una tarea a la cola (y hace commit). Si ya hay una pendiente idéntica
+    (mismo tipo y parámetros) no se duplica: se devuelve esa, con la prioridad más alta
+    y la fecha de ejecución más temprana de las dos.
+
+    Las tareas de TAREAS_EXCEL no se deduplican: se ejecutan en el orden en que se encolan
+    y juntar una escritura con otra anterior idéntica la adelantaría a las que van entre medias.
+    """
+    if tipo not in MANEJADORES:
+        raise ValueError(f"Tipo de tarea desconocido: {tipo}")
+
+    clave = clave_tarea(tipo, parametros)
+    if tipo in TAREAS_EXCEL:
+        # Clave única: el índice de pendientes idénticas no las junta
+        clave = f"{clave}#{uuid.uuid4().hex}"
+    existente = db.query(Tarea).filter_by(clave=clave, estado=PENDIENTE).first()
+    if existente is None:
+        tarea = Tarea(
+            tipo=tipo,
+            parametros=json.dumps(parametros or {}, ensure_ascii=False),
+            clave=clave,
+            prioridad=prioridad,
+            max_intentos=max_intentos,
+            ejecutar_desde=ejecutar_desde or ahora(),
+        )
+        db.add(tarea)
+        try:
+            db.commit()
+            planificador.avisar()
+            return tarea
+        except IntegrityError:
+            # Otra petición la ha encolado a la vez (índice único de pendientes)
+            db.rollback()
+            existente = db.query(Tarea).filter_by(clave=clave, estado=PENDIENTE).first()
+            if existente is None:
+                raise
+
+    # La tarea idéntica se ejecuta una sola vez: con la prioridad más alta y en la fecha más temprana
+    cambiada = False
+    if prioridad > existente.prioridad:
+        existente.prioridad, cambiada = prioridad, True
+    if ejecutar_desde is None or ejecutar_desde < existente.ejecutar_desde:
+        existente.ejecutar_desde, cambiada = ejecutar_desde or ahora(), True
+    if cambiada:
+        db.commit()
+        planificador.avisar()
+    return existente
+
+
+def _proxima_ejecucion(hora, desde):
+    siguiente = desde.replace(hour=hora, minute=0, second=0, microsecond=0)
+    return siguiente if siguiente > desde else siguiente + timedelta(days=1)
+
+
+class Planificador:
+    """
+    Ejecuta las tareas de la tabla 'tareas' en un grupo acotado de hilos.
+
+    1. Un hilo despachador reclama la siguiente tarea pendiente (prioridad, antigüedad)
+       con un UPDATE condicionado al estado: si dos procesos la reclaman, solo uno gana.
+    2. Solo se reclama una tarea cuando hay un trabajador libre: la cola crece en la BD,
+       no en memoria, y el trabajo pesado nunca se acumula en los hilos de las peticiones.
+    3. Si una tarea falla se reprograma con espera exponencial hasta agotar sus intentos.
+    4. Las tareas de TAREAS_EXCEL forman un carril de un solo trabajador: solo se reclama
+       la más antigua pendiente y solo si no hay otra en curso (también en otros procesos).
+    5. Cada tarea reclamada lleva el propietario (este proceso) y un latido que el despachador
+       renueva. Solo vuelven a la cola las tareas cuyo latido ha caducado (su proceso ha muerto),
+       nunca las que otro proceso vivo está ejecutando.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_trabajadores=MAX_TRABAJADORES):
+        self.session_factory = session_factory
+        self.max_trabajadores = max_trabajadores
+        self.propietario = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._ultimo_latido = None
+        self._libres = threading.Semaphore(max_trabajadores)
+        self._aviso = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self._pool = None
+
+    def avisar(self):
+        self._aviso.set()
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        self._recuperar_caducadas()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_trabajadores, thread_name_prefix="tarea")
+        self._hilo = threading.Thread(target=self._despachar, name="planificador", daemon=True)
+        self._hilo.start()
+        print(f"🗓️ Planificador de tareas iniciado ({self.max_trabajadores} trabajadores).")
+
+    def detener(self):
+        if self._hilo is None:
+            return
+        self._parar.set()
+        self._aviso.set()
+        self._hilo.join()
+        self._pool.shutdown(wait=True)
+        self._hilo = None
+
+    def _recuperar_caducadas(self):
+        # Las tareas en curso cuyo proceso ha dejado de latir (parado o muerto) vuelven a la cola
+        limite = ahora() - timedelta(seconds=CONCESION)
+        with self.session_factory() as db:
+            n = db.execute(
+                update(Tarea)
+                .where(Tarea.estado == EN_CURSO, or_(Tarea.latido.is_(None), Tarea.latido < limite))
+                .values(estado=PENDIENTE, propietario=None, latido=None, mensaje="Interrumpida, se reintenta")
+            ).rowcount
+            db.commit()
+        if n:
+            print(f"🔁 {n} tareas interrumpidas vuelven a la cola.")
+
+    def _latir(self):
+        """Renueva el latido de las tareas de este proceso y recupera las abandonadas por otros."""
+        momento = ahora()
+        if self._ultimo_latido and (momento - self._ultimo_latido).total_seconds() < INTERVALO_LATIDO:
+            return
+        self._ultimo_latido = momento
+        with self.session_factory() as db:
+            db.execute(
+                update(Tarea)
+                .where(Tarea.estado == EN_CURSO, Tarea.propietario == self.propietario)
+                .values(latido=momento)
+            )
+            db.commit()
+        self._recuperar_caducadas()
+
+    def _programar_periodicas(self, db):
+        momento = ahora()
+        for tipo, parametros, hora in PERIODICAS:
+            encolar(db, tipo, parametros, PRIORIDAD_BAJA, _proxima_ejecucion(hora, momento))
+
+    def _reclamar(self, db):
+        """Marca como en curso la siguiente tarea pendiente. Devuelve su id o None."""
+        otra = aliased(Tarea)
+        excel_en_curso = exists().where(otra.tipo.in_(TAREAS_EXCEL), otra.estado == EN_CURSO)
+        primera_excel = (
+            select(func.min(otra.id))
+            .where(otra.tipo.in_(TAREAS_EXCEL), otra.estado == PENDIENTE)
+            .scalar_subquery()
+        )
+        # Una tarea del Excel solo puede empezar si es la primera de su carril y el carril está libre
+        en_su_turno = or_(
+            Tarea.tipo.notin_(TAREAS_EXCEL),
+            and_(~excel_en_curso, Tarea.id == primera_excel),
+        )
+        while True:
+            candidata = (
+                db.query(Tarea.id)
+                .filter(Tarea.estado == PENDIENTE, Tarea.ejecutar_desde <= ahora(), en_su_turno)
+                .order_by(Tarea.prioridad.desc(), Tarea.id)
+                .first()
+            )
+            if candidata is None:
+                return None
+            reclamada = db.execute(
+                update(Tarea)
+                .where(Tarea.id == candidata.id, Tarea.estado == PENDIENTE, en_su_turno)
+                .values(estado=EN_CURSO, iniciada=ahora(), intentos=Tarea.intentos + 1, mensaje=None,
+                        propietario=self.propietario, latido=ahora())
+            ).rowcount
+            db.commit()
+            if reclamada:
+                return candidata.id
+
+    def _despachar(self):
+        while not self._parar.is_set():
+            try:
+                self._latir()
+                with self.session_factory() as db:
+                    self._programar_periodicas(db)
+                    while not self._parar.is_set() and self._libres.acquire(blocking=False):
+                        tarea_id = self._reclamar(db)
+                        if tarea_id is None:
+                            self._libres.release()
+                            break
+                        self._pool.submit(self._ejecutar, tarea_id)
+            except Exception as e:
+                print(f"❌ Error en el planificador de tareas: {e}")
+            self._aviso.wait(INTERVALO_SONDEO)
+            self._aviso.clear()
+
+    def _progreso(self, tarea_id):
+        def progreso(fraccion, mensaje=None):
+            with self.session_factory() as db:
+                db.execute(
+                    update(Tarea).where(Tarea.id == tarea_id, Tarea.propietario == self.propietario)
+                    .values(progreso=max(0.0, min(1.0, float(fraccion))), mensaje=mensaje, latido=ahora())
+                )
+                db.commit()
+        return progreso
+
+    def _sigue_siendo_mia(self, tarea):
+        # Si la concesión caducó (p. ej. el proceso estuvo parado) otro proceso puede haberla
+        # reclamado: su resultado es el que vale
+        if tarea.propietario == self.propietario:
+            return True
+        print(f"⚠️ Tarea {tarea.id} reclamada por otro proceso ({tarea.propietario}): se descarta este resultado.")
+        return False
+
+    def _ejecutar(self, tarea_id):
+        db = self.session_factory()
+        try:
+            tarea = db.get(Tarea, tarea_id)
+            parametros = json.loads(tarea.parametros) if tarea.parametros else {}
+            print(f"⚙️ Tarea {tarea_id} ({tarea.tipo}) en curso, intento {tarea.intentos}/{tarea.max_intentos}")
+            try:
+                resultado = MANEJADORES[tarea.tipo](db, parametros, self._progreso(tarea_id))
+            except Exception as e:
+                db.rollback()
+                tarea = db.get(Tarea, tarea_id)
+                if not self._sigue_siendo_mia(tarea):
+                    return
+                tarea.mensaje = f"{e.__class__.__name__}: {e}"
+                if tarea.intentos < tarea.max_intentos:
+                    tarea.estado = PENDIENTE
+                    tarea.ejecutar_desde = ahora() + timedelta(seconds=ESPERA_REINTENTO * 2 ** (tarea.intentos - 1))
+                    print(f"⚠️ Tarea {tarea_id} fallida, se reintentará: {tarea.mensaje}")
+                else:
+                    tarea.estado = FALLIDA
+                    tarea.terminada = ahora()
+                    tarea.resultado = json.dumps({"error": traceback.format_exc()[-2000:]}, ensure_ascii=False)
+                    print(f"❌ Tarea {tarea_id} fallida definitivamente: {tarea.mensaje}")
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Ya hay otra pendiente idéntica: esta se da por fallida
+                    db.rollback()
+                    tarea = db.get(Tarea, tarea_id)
+                    tarea.estado, tarea.terminada = FALLIDA, ahora()
+                    db.commit()
+                return
+
+            db.refresh(tarea)
+            if not self._sigue_siendo_mia(tarea):
+                return
+            tarea.estado = COMPLETADA
+            tarea.progreso = 1.0
+            tarea.terminada = ahora()
+            tarea.resultado = json.dumps(resultado, ensure_ascii=False, default=str)
+            db.commit()
+            print(f"✅ Tarea {tarea_id} ({tarea.tipo}) completada.")
+        finally:
+            db.close()
+            self._libres.release()
+            self.avisar()
+
+
+planificador = Planificador()
+
+
+# -----------------------------------------------------
+# Tareas disponibles
+# -----------------------------------------------------
+def _municipio(nombre):
+    from app.diff_excel import _normalizar_valor
+
+    return _normalizar_valor(nombre)
+
+
+@manejador("conciliar")
+def conciliar(db, parametros, progreso):
+    """
+    Compara el Excel de cada región con su BD. Con 'aplicar' lleva a la BD las celdas que han
+    cambiado en el Excel (con historial y control de versión, municipio a municipio).
+    """
+    def conciliar_region(db_region, excel, progreso_region):
+        return _conciliar_region(db_region, excel, parametros.get("aplicar"), progreso_region)
+
+    return _por_region(parametros, progreso, conciliar_region)
+
+
+def _conciliar_region(db, excel, aplicar, progreso):
+    from app.concurrencia import guardar_respuestas
+    from app.diff_excel import dataframe_desde_db, diferencias, leer_excel
+    from app.models import Ayuntamiento
+    from app.ranking import obtener_indice
+    from app.scoring import obtener_motor
+
+    progreso(0.05, "Comparando el Excel con la base de datos")
+    cambios = diferencias(dataframe_desde_db(db), leer_excel(excel))
+    resultado = {
+        "resumen": cambios["resumen"],
+        "filas_nuevas": cambios["filas_nuevas"],
+        "filas_borradas": cambios["filas_borradas"],
+        "aplicadas": 0,
+    }
+    if not aplicar or not cambios["celdas"]:
+        return resultado
+
+    por_municipio = {}
+    for celda in cambios["celdas"]:
+        por_municipio.setdefault(celda["municipio"], {})[celda["columna"]] = celda["despues"]
+
+    aytos = {_municipio(a.nombre): a for a in db.query(Ayuntamiento)}
+    motor, indice = obtener_motor(db), obtener_indice(db)
+    for i, (nombre, nuevos) in enumerate(por_municipio.items(), start=1):
+        ayto = aytos.get(nombre)
+        if ayto is None:
+            continue
+        datos, respuestas, _, version_subida = guardar_respuestas(
+            db, ayto, nuevos, autor="conciliación", calcular_nivel=motor.calcular_nivel
+        )
+        motor.actualizar_respuestas(ayto.id, respuestas, version_subida)
+        indice.actualizar(ayto.id, respuestas, datos.nivel_digitalizacion, version_subida)
+        resultado["aplicadas"] += len(nuevos)
+        progreso(0.1 + 0.9 * i / len(por_municipio), f"{i}/{len(por_municipio)} municipios actualizados")
+    return resultado
+
+
+def _valor_excel(serie, valor):
+    # En columnas numéricas se escribe el número, no el texto '3'
+    if valor is not None and serie.dtype.kind in "if":
+        numero = a_numero(valor)
+        if numero is not None:
+            return int(numero) if numero.is_integer() else numero
+    return valor
+
+
+def _escribir_celda(df, fila, columna, valor):
+    valor = _valor_excel(df[columna], valor)
+    posicion = df.columns.get_loc(columna)
+    try:
+        df.iloc[fila, posicion] = valor
+    except (TypeError, ValueError):
+        # pandas no cambia el tipo de la columna al asignar (texto en una columna vacía o numérica)
+        df[columna] = df[columna].astype(object)
+        df.iloc[fila, posicion] = valor
+
+
+@manejador("exportar_excel")
+def exportar_excel(db, parametros, progreso):
+    """Escribe en el Excel de cada región las respuestas guardadas en su BD (solo municipios y columnas que ya existen)."""
+    return _por_region(parametros, progreso, _exportar_region)
+
+
+def _exportar_region(db, excel, progreso):
+    from app.concurrencia import reescribir_excel
+    from app.diff_excel import dataframe_desde_db, diferencias
+
+    progreso(0.05, "Leyendo la base de datos")
+    desde_db = dataframe_desde_db(db)
+
+    def aplicar(df):
+        progreso(0.3, "Calculando los cambios")
+        etiquetas = {str(c).strip(): c for c in df.columns}
+        cambios = diferencias(df, desde_db)
+        filas = {}
+        for i, nombre in enumerate(df[etiquetas[MUNICIPIO_COL]]):
+            filas.setdefault(_municipio(nombre), i)
+        escritas = 0
+        for celda in cambios["celdas"]:
+            columna, fila = etiquetas.get(celda["columna"]), filas.get(celda["municipio"])
+            if columna is None or fila is None:
+                continue
+            _escribir_celda(df, fila, columna, celda["despues"])
+            escritas += 1
+        progreso(0.7, f"Escribiendo {escritas} celdas")
+        return {"celdas": escritas, "filas_solo_en_bd": cambios["filas_nuevas"]}
+
+    return reescribir_excel(excel, aplicar)
+
+
+@manejador("escribir_excel")
+def escribir_excel(db, parametros, progreso):
+    """
+    Cambios de un municipio (por su nombre en AYUNTAMIENTO) en el Excel de su región,
+    fuera del hilo de la petición.
+    """
+    from app.concurrencia import reescribir_excel
+
+    municipio, cambios = _municipio(parametros["municipio"]), parametros.get("cambios", {})
+    region, = regiones_tarea({"region": parametros.get("region", REGION_POR_DEFECTO)})
+
+    def aplicar(df):
+        etiquetas = {str(c).strip(): c for c in df.columns}
+        if MUNICIPIO_COL not in etiquetas:
+            raise ValueError(f"El Excel no tiene la columna '{MUNICIPIO_COL}'")
+        filas = [i for i, nombre in enumerate(df[etiquetas[MUNICIPIO_COL]]) if _municipio(nombre) == municipio]
+        if not filas:
+            raise ValueError(f"No se encontró el municipio '{parametros['municipio']}' en el Excel")
+        desconocidas = [c for c in cambios if str(c).strip() not in etiquetas]
+        for col, val in cambios.items():
+            columna = etiquetas.get(str(col).strip())
+            if columna is not None:
+                _escribir_celda(df, filas[0], columna, val)
+        return {"celdas": len(cambios) - len(desconocidas), "columnas_desconocidas": desconocidas}
+
+    return reescribir_excel(obtener_router().excel(region), aplicar)
+
+
+@manejador("compactar_historial")
+def compactar_historial(db, parametros, progreso):
+    from app.historial import compactar
+
+    def compactar_region(db_region, excel, progreso_region):
+        creadas = compactar(db_region)
+        db_region.commit()
+        return {"instantaneas": creadas}
+
+    return _por_region(parametros, progreso, compactar_region)
@@ -2,7 +2,10 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px # Importamos Plotly para gráficos interactivos
+import plotly.io as pio # Las figuras llegan ya serializadas desde la caché de gráficos
+from app.catalogo import obtener_catalogo # Catálogo de preguntas compartido con la API
+from app.dataset import obtener_dataset # Dataset compacto compartido por todo el proceso
+from app.graficos import BARRAS, TARTA, HISTOGRAMA, cache_graficos # Figuras cacheadas por versión de datos
 
 # ----------------------------------------------------------------------
 # CONFIGURACIÓN
@@ -17,17 +20,17 @@ MUNICIPIO_COL = "AYUNTAMIENTO"
 # FUNCIONES DE CARGA Y PROCESAMIENTO
 # ----------------------------------------------------------------------
 
-@st.cache_data
+# Sin caché de Streamlit: obtener_dataset ya guarda un dataset por proceso y lo vuelve a
+# cargar cuando cambia el Excel, así que se llama en cada ejecución del script.
+# El DataFrame es compartido y NO se debe modificar: las columnas derivadas se calculan en el cargador.
 def load_data():
     """Carga el Excel y extrae el DataFrame y las columnas de encuesta (P)."""
     try:
-        # 1. Cargar el Excel
-        df = pd.read_excel(EXCEL_PATH, engine="openpyxl")
-        
-        # 2. Normalizar nombres de columnas a mayúsculas para evitar errores (AYUNTAMIENTO vs Ayuntamiento)
-        df.columns = df.columns.str.upper().str.strip()
+        # 1. Dataset compartido con tipos compactos según el catálogo
+        #    (los nombres de columnas se limpian igual que en el catálogo y la BD)
+        df = obtener_dataset(EXCEL_PATH)
 
-        # 3. Verificar si la columna principal existe después de la normalización
+        # 2. Verificar si la columna principal existe después de la normalización
         if MUNICIPIO_COL not in df.columns:
             st.error(f"¡Error Crítico! No se encontró la columna '{MUNICIPIO_COL}' en el Excel.")
             st.warning("Columnas encontradas (normalizadas):")
@@ -35,17 +38,10 @@ def load_data():
             # Devolvemos un DataFrame vacío y una lista vacía para manejar el error
             return pd.DataFrame(), [] 
 
-        # 4. Obtener las columnas de encuesta
-        p_columns_raw = [col for col in df.columns if col.startswith("P") and not col.startswith("PONDER")]
-        
-        # 5. Limpieza y filtrado de columnas P
-        # Filtramos columnas que parecen ser solo contadores repetidos
-        p_columns_clean = [
-            col for col in p_columns_raw
-            if not col.strip().upper().endswith("Nº")
-            and not col.strip().upper() == "P6. FORMACIÓN CONJUNTO" # Si hay 7 P6 repetidas, ignoramos la base
-            and not col.strip().upper() == "P7. FORMACIÓN A PRECISAR" # Si hay 7 P7 repetidas, ignoramos la base
-        ]
+        # 3. Obtener las columnas de encuesta del catálogo de preguntas
+        #    (sin PONDER* ni las columnas de recuento 'Nº')
+        catalogo = obtener_catalogo(EXCEL_PATH)
+        p_columns_clean = catalogo.columnas(incluir_recuentos=False)
 
         # Convertir a lista y devolver
         return df, p_columns_clean
@@ -170,11 +166,16 @@ if not data.empty:
     
     # 1. Total de Ayuntamientos
     st.sidebar.metric("Ayuntamientos en la Encuesta", len(municipios))
+    if "nivel_calculado" in data.columns:
+        st.sidebar.metric("Nivel medio de digitalización", f"{data['nivel_calculado'].mean():.1f} %")
 
     # 2. Resumen de columnas (solo las P)
     st.sidebar.markdown("---")
     st.sidebar.subheader("Preguntas Disponibles")
     st.sidebar.text(f"Se encontraron {len(p_columns)} preguntas para el formulario.")
+    memoria = data.attrs.get("memoria")
+    if memoria:
+        st.sidebar.caption(f"Memoria del dataset: {memoria['antes_mb']} MB → {memoria['despues_mb']} MB")
 
     # 3. Visualización simple de datos
     st.header("Dashboard de Respuestas de Encuesta")
@@ -196,27 +197,23 @@ if not data.empty:
 
         col1, col2 = st.columns(2)
         
-        # Nombres de columna que usaremos (aseguramos mayúsculas y eliminamos espacios extra)
-        P1_COL = "P1. FORMACIÓN"
-        P8_COL = "P8. FIBRA OPTICA" # <--- CORRECCIÓN AQUI
-        P3_COL = "P3. Nº FUNCIONARIOS"
+        # Nombres de columna que usaremos, buscados por id en el catálogo
+        catalogo = obtener_catalogo(EXCEL_PATH)
+        P1_COL = catalogo.pregunta("P1").columna
+        P8_COL = catalogo.pregunta("P8").columna
+        P3_COL = catalogo.pregunta("P3.N").columna # Recuento numérico de funcionarios
+
+        # Las figuras salen de la caché de gráficos (JSON ya calculado por pregunta, tipo,
+        # filtros y versión de los datos): en cada rerun solo se deserializan.
+        def mostrar_figura(pregunta, tipo=None, filtros=None, mayusculas=False):
+            figura = cache_graficos.obtener(data, pregunta, tipo, filtros, mayusculas=mayusculas)
+            st.plotly_chart(pio.from_json(figura), use_container_width=True)
 
         # Gráfico 1: P1. Formación (Gráfico de Barras)
         if P1_COL in data.columns:
             with col1:
                 st.subheader(f"{P1_COL}: ¿Existe Plan de Formación?")
-                # Contar ocurrencias, renombrar el índice para la leyenda y resetear el índice para Plotly
-                df_counts = data[P1_COL].value_counts().reset_index()
-                df_counts.columns = ['Respuesta', 'Conteo']
-                
-                fig_bar = px.bar(
-                    df_counts,
-                    x='Respuesta',
-                    y='Conteo',
-                    title=f'Distribución de Respuestas {P1_COL}',
-                    color='Respuesta',
-                )
-                st.plotly_chart(fig_bar, use_container_width=True)
+                mostrar_figura(catalogo.pregunta("P1"), BARRAS)
         else:
             col1.warning(f"Columna '{P1_COL}' no encontrada para el análisis. Columnas disponibles: {', '.join(data.columns)}")
 
@@ -224,44 +221,46 @@ if not data.empty:
         if P8_COL in data.columns:
             with col2:
                 st.subheader(f"{P8_COL}: ¿Dispone de Fibra Óptica?")
-                # Contar ocurrencias (ignorando NaN y convirtiendo a string)
-                # NOTA: Usamos P8_COL
-                df_pie = data[P8_COL].astype(str).str.upper().value_counts().reset_index()
-                df_pie.columns = ['Respuesta', 'Conteo']
-                
-                fig_pie = px.pie(
-                    df_pie,
-                    values='Conteo',
-                    names='Respuesta',
-                    title=f'Proporción de {P8_COL}',
-                )
-                st.plotly_chart(fig_pie, use_container_width=True)
+                # Respuestas en mayúsculas: se transforman las etiquetas ya contadas, no la columna
+                mostrar_figura(catalogo.pregunta("P8"), TARTA, mayusculas=True)
         else:
             col2.warning(f"Columna '{P8_COL}' no encontrada para el análisis. Columnas disponibles: {', '.join(data.columns)}")
 
 
         # Gráfico 3: P3. Nº funcionarios (Histograma para datos numéricos)
-        # Intentamos convertir la columna a numérica y solo si tiene éxito, dibujamos
         if P3_COL in data.columns:
             st.markdown("---")
-            st.subheader(f"Distribución de la Variable {P3_COL} (Nº de Funcionarios)")
-            
-            # Limpieza y conversión a numérico
-            data['P3_NUM'] = pd.to_numeric(data[P3_COL], errors='coerce')
-            
-            # Filtrar valores no válidos (NaN) después de la conversión
-            df_hist = data.dropna(subset=['P3_NUM'])
-            
-            if not df_hist.empty:
-                fig_hist = px.histogram(
-                    df_hist,
-                    x='P3_NUM',
-                    nbins=10, # Número de contenedores/barras
-                    title='Conteo de Ayuntamientos por Rango de Funcionarios'
-                )
-                fig_hist.update_layout(xaxis_title="Número de Funcionarios")
-                st.plotly_chart(fig_hist, use_container_width=True)
+            st.subheader(f"Distribución de la Variable {catalogo.pregunta('P3.N').nombre}")
+
+            # La columna ya es numérica (Int64) desde el cargador: no se modifica 'data'
+            if data[P3_COL].notna().any():
+                mostrar_figura(catalogo.pregunta("P3.N"), HISTOGRAMA)
             else:
                 st.warning(f"No hay suficientes datos numéricos válidos en '{P3_COL}' para generar el histograma.")
         else:
             st.warning(f"Columna '{P3_COL}' no encontrada para el análisis. Columnas disponibles: {', '.join(data.columns)}")
+
+        # Gráfico 4: cualquier pregunta P, con filtro opcional por la respuesta a otra pregunta
+        st.markdown("---")
+        st.subheader("Explorar cualquier pregunta")
+        columnas_grafico = catalogo.columnas()
+        col_pregunta, col_tipo = st.columns([3, 1])
+        pregunta_libre = col_pregunta.selectbox("Pregunta:", options=columnas_grafico)
+        tipo_libre = col_tipo.selectbox("Tipo de gráfico:", options=["automático", BARRAS, TARTA, HISTOGRAMA])
+
+        col_filtro, col_valor = st.columns(2)
+        pregunta_filtro = col_filtro.selectbox("Filtrar por (opcional):", options=["--- Sin filtro ---"] + p_columns)
+        filtros = None
+        if pregunta_filtro != "--- Sin filtro ---":
+            valores_filtro = catalogo.pregunta(pregunta_filtro).valores
+            if valores_filtro:
+                elegidos = col_valor.multiselect("Respuestas:", options=valores_filtro)
+                filtros = {pregunta_filtro: elegidos} if elegidos else None
+            else:
+                col_valor.caption("Solo se puede filtrar por preguntas con respuestas cerradas.")
+
+        mostrar_figura(
+            catalogo.pregunta(pregunta_libre),
+            None if tipo_libre == "automático" else tipo_libre,
+            filtros,
+        )
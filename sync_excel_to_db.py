@@ -1,11 +1,14 @@
 import os
+import sys
 import pandas as pd
 import json
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, inspect, select
 from sqlalchemy.orm import sessionmaker
 # Importamos la configuración actualizada
 from app.database import Base, DATABASE_URL 
-from app.models import Ayuntamiento, DatosAyuntamiento
+from app.models import Ayuntamiento, CambioRespuesta, DatosAyuntamiento, InstantaneaAyuntamiento
+from app.scoring import MotorPuntuacion, cargar_pesos
+from app.busqueda import crear_indice, reconstruir_indice
 
 # -----------------------------------------------------
 # CONFIGURACIÓN
@@ -13,6 +16,60 @@ from app.models import Ayuntamiento, DatosAyuntamiento
 EXCEL_PATH = "data/ENCUESTAS_datosIA.xlsx"
 MUNICIPIO_COL = "AYUNTAMIENTO" # ¡Columna correcta según tu Excel!
 
+# Región a sincronizar: python sync_excel_to_db.py --region valencia
+# Usa la base de datos y el Excel de esa región (data/shards.json).
+if "--region" in sys.argv:
+    from app.shards import obtener_router
+
+    region = sys.argv[sys.argv.index("--region") + 1]
+    regiones = obtener_router()
+    DATABASE_URL = regiones.regiones[region]["url"]
+    EXCEL_PATH = regiones.excel(region)
+    print(f"🗺️ Región {region}: {DATABASE_URL} ← {EXCEL_PATH}")
+
+# -----------------------------------------------------
+# 0️⃣ Modo simulación: python sync_excel_to_db.py --dry-run
+#     Muestra qué cambiaría la sincronización sin tocar la base de datos.
+# -----------------------------------------------------
+if "--dry-run" in sys.argv:
+    from app.diff_excel import dataframe_desde_db, diferencias, imprimir_resumen, leer_excel
+
+    db_actual = sessionmaker(bind=create_engine(DATABASE_URL))()
+    try:
+        cambios = diferencias(dataframe_desde_db(db_actual, MUNICIPIO_COL), leer_excel(EXCEL_PATH), MUNICIPIO_COL)
+    finally:
+        db_actual.close()
+    imprimir_resumen(cambios)
+    print("\nℹ️ Simulación: no se ha modificado la base de datos.")
+    sys.exit(0)
+
+# -----------------------------------------------------
+# 0️⃣ Historial: regenerar la base de datos borra los cambios y las instantáneas de
+#     respuestas (y los municipios se crean con ids nuevos). Si hay historial no se
+#     regenera salvo con --forzar; para cargar el Excel conservándolo:
+#     python -m app.ingesta data/ENCUESTAS_datosIA.xlsx
+# -----------------------------------------------------
+hay_bd = not DATABASE_URL.startswith("sqlite:///") or os.path.exists(DATABASE_URL.replace("sqlite:///", ""))
+if hay_bd and "--forzar" not in sys.argv:
+    motor_actual = create_engine(DATABASE_URL)
+    try:
+        inspector = inspect(motor_actual)
+        with motor_actual.connect() as conn:
+            historial = {
+                modelo.__tablename__: conn.execute(select(func.count()).select_from(modelo.__table__)).scalar()
+                for modelo in (CambioRespuesta, InstantaneaAyuntamiento)
+                if inspector.has_table(modelo.__tablename__)
+            }
+    finally:
+        motor_actual.dispose()
+    if any(historial.values()):
+        print("❌ La base de datos tiene historial de respuestas que la sincronización borraría:")
+        for tabla, filas in historial.items():
+            print(f"     {tabla}: {filas} filas")
+        print("   Para cargar el Excel conservando el historial: python -m app.ingesta " + EXCEL_PATH)
+        print("   Para regenerarla igualmente (se pierde el historial): python sync_excel_to_db.py --forzar")
+        sys.exit(1)
+
 # -----------------------------------------------------
 # 1️⃣ Elimina la base de datos anterior si existe
 # -----------------------------------------------------
@@ -38,6 +95,7 @@ else:
 # -----------------------------------------------------
 engine = create_engine(DATABASE_URL)
 Base.metadata.create_all(bind=engine)
+crear_indice(engine)
 SessionLocal = sessionmaker(bind=engine)
 db = SessionLocal()
 
@@ -50,6 +108,10 @@ df = pd.read_excel(EXCEL_PATH)
 df.columns = [str(c).strip() for c in df.columns] 
 print(f"✅ {len(df)} filas cargadas desde el Excel.")
 
+# Calcular el nivel de digitalización de todos los municipios en una sola pasada
+motor = MotorPuntuacion(df, cargar_pesos(df))
+print(f"📊 Nivel de digitalización calculado con {len(motor.columnas)} preguntas puntuables.")
+
 # -----------------------------------------------------
 # 4️⃣ Crear los registros
 # -----------------------------------------------------
@@ -61,14 +123,15 @@ for idx, row in df.iterrows():
         print(f"⚠️ Fila {idx}: sin nombre de municipio (valor: '{row.get(MUNICIPIO_COL)}'), saltando.")
         continue
     
-    # Intenta obtener el nivel de digitalización, por si es la columna que usas en el Excel
-    nivel_digitalizacion_excel = row.get("Nivel de digitalización (%)") 
-    
-    # Convertir a float de forma segura
-    try:
-        nivel = float(nivel_digitalizacion_excel) if nivel_digitalizacion_excel else 0.0
-    except ValueError:
-        nivel = 0.0
+    # Nivel calculado a partir de las respuestas P
+    nivel = motor.nivel(idx)
+    if nivel is None:
+        # Si no hay respuestas puntuables, usamos el valor del Excel (si existe)
+        nivel_digitalizacion_excel = row.get("Nivel de digitalización (%)") 
+        try:
+            nivel = float(nivel_digitalizacion_excel) if nivel_digitalizacion_excel else 0.0
+        except ValueError:
+            nivel = 0.0
 
     # Crea el ayuntamiento principal
     ayto = Ayuntamiento(
@@ -99,6 +162,9 @@ for idx, row in df.iterrows():
 # -----------------------------------------------------
 # 5️⃣ Guardar y cerrar
 # -----------------------------------------------------
+# Índice de búsqueda de texto completo sobre las notas y respuestas libres
+reconstruir_indice(db)
+
 db.commit()
 db.close()
 print("\n🎉 Sincronización completada con éxito. Base de datos regenerada.")
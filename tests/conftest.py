@@ -0,0 +1,33 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models  # noqa: F401
+from app.busqueda import crear_indice
+from app.database import Base
+from app.models import Ayuntamiento, DatosAyuntamiento
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Sesión sobre una base de datos SQLite vacía (con el índice de búsqueda) en un directorio temporal."""
+    motor = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=motor)
+    crear_indice(motor)
+    sesion = sessionmaker(autocommit=False, autoflush=False, bind=motor)()
+    yield sesion
+    sesion.close()
+    motor.dispose()
+
+
+@pytest.fixture
+def ayto(db):
+    """Un municipio con dos respuestas guardadas."""
+    ayto = Ayuntamiento(codigo="altea", nombre="Altea", password="1234")
+    db.add(ayto)
+    db.flush()
+    db.add(DatosAyuntamiento(ayto_id=ayto.id, data_json=json.dumps({"P1": "1. Sí", "P2": "2. No"})))
+    db.commit()
+    return ayto
@@ -0,0 +1,45 @@
+import pytest
+
+from app.concurrencia import ConflictoEdicion, guardar_respuestas
+from app.models import CambioRespuesta
+
+
+def test_version_antigua_sin_preguntas_comunes_se_fusiona(db, ayto):
+    version_formulario = ayto.datos.version
+    # Otro usuario guarda P2 mientras el primero tiene el formulario abierto
+    guardar_respuestas(db, ayto, {"P2": "1. Sí"}, version_base=version_formulario, autor="otro")
+
+    datos, respuestas, _, version_subida = guardar_respuestas(
+        db, ayto, {"P1": "2. No"}, version_base=version_formulario, autor="altea"
+    )
+
+    assert version_subida
+    assert respuestas == {"P1": "2. No", "P2": "1. Sí"}
+    assert datos.version == version_formulario + 2
+
+
+def test_version_antigua_con_la_misma_pregunta_es_conflicto(db, ayto):
+    version_formulario = ayto.datos.version
+    guardar_respuestas(db, ayto, {"P1": "2. No"}, version_base=version_formulario, autor="otro")
+
+    with pytest.raises(ConflictoEdicion) as error:
+        guardar_respuestas(db, ayto, {"P1": "3. No sabe"}, version_base=version_formulario, autor="altea")
+
+    assert error.value.conflictos == [
+        {"pregunta": "P1", "tuyo": "3. No sabe", "actual": "2. No", "autor": "otro"}
+    ]
+    assert error.value.version_actual == version_formulario + 1
+    # El guardado rechazado no deja eventos
+    assert db.query(CambioRespuesta).filter_by(autor="altea").count() == 0
+
+
+def test_version_antigua_con_el_mismo_valor_no_es_conflicto(db, ayto):
+    version_formulario = ayto.datos.version
+    guardar_respuestas(db, ayto, {"P1": "2. No"}, version_base=version_formulario, autor="otro")
+
+    _, respuestas, _, version_subida = guardar_respuestas(
+        db, ayto, {"P1": "2. No"}, version_base=version_formulario, autor="altea"
+    )
+
+    assert respuestas["P1"] == "2. No"
+    assert not version_subida
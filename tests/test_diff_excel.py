@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.catalogo import MUNICIPIO_COL
+from app.diff_excel import _normalizar_valor, diferencias
+
+
+@pytest.mark.parametrize("valor", [1, 1.0, "1", "1 ", np.int64(1), np.float64(1.0)])
+def test_mismo_numero_con_distinto_tipo(valor):
+    assert _normalizar_valor(valor) == "1"
+
+
+@pytest.mark.parametrize("valor", [None, np.nan, pd.NA, "", "   "])
+def test_vacios(valor):
+    assert _normalizar_valor(valor) is None
+
+
+def test_diferencias_ignora_tipos_y_espacios():
+    # Excel (números como float, textos con espacios) frente a la BD (JSON)
+    antes = pd.DataFrame({MUNICIPIO_COL: ["Altea", "Calp"], "P1": [1.0, 2.0], "P2": ["1 ", "Sí "], "P3": [1, None]})
+    despues = pd.DataFrame({MUNICIPIO_COL: ["Altea", "Calp"], "P1": [1, 3], "P2": ["1", "Sí"], "P3": ["1", None]})
+
+    resultado = diferencias(antes, despues)
+
+    assert resultado["celdas"] == [{"municipio": "Calp", "columna": "P1", "antes": "2", "despues": "3"}]
+    assert resultado["resumen"]["filas_cambiadas"] == 1
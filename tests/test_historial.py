@@ -0,0 +1,23 @@
+from app.concurrencia import guardar_respuestas
+from app.historial import compactar, estado_en
+from app.models import InstantaneaAyuntamiento, ahora
+
+
+def test_estado_en_antes_y_despues_de_compactar(db, ayto):
+    inicial = estado_en(db, ayto.id)
+    fechas, estados = [], []
+    for i in range(6):
+        _, respuestas, _, _ = guardar_respuestas(db, ayto, {"P1": f"{i}. Sí", "P3": i})
+        fechas.append(ahora())
+        estados.append(respuestas)
+        if i == 2:
+            # Instantánea a mitad del historial: las fechas de antes y de después deben salir igual
+            assert compactar(db, umbral=2) == 1
+            db.commit()
+
+    assert db.query(InstantaneaAyuntamiento).filter_by(ayto_id=ayto.id).count() == 2
+    for fecha, esperado in zip(fechas, estados):
+        assert estado_en(db, ayto.id, fecha) == esperado
+    # Antes del primer cambio vale el estado de partida
+    assert estado_en(db, ayto.id, fechas[0].replace(year=2000)) == inicial
+    assert estado_en(db, ayto.id) == estados[-1]
@@ -0,0 +1,36 @@
+import math
+
+import pytest
+
+from app.scoring import puntuar_respuesta
+
+
+@pytest.mark.parametrize("respuesta, puntos", [
+    ("1. Sí", 1.0),
+    ("2. Sí, alojada en la nube ", 1.0),
+    ("2. No", 0.0),
+    ("3. No, no se ha solicitado", 0.0),
+    ("3. Uso un programa que no es especifico", 0.5),
+])
+def test_respuestas_puntuables(respuesta, puntos):
+    assert puntuar_respuesta(respuesta) == puntos
+
+
+@pytest.mark.parametrize("respuesta", [
+    # Palabras que empiezan por "si" / "no" no son un sí o un no
+    "9. Sistemas Informáticos",
+    "SIR",
+    "Sir, Orbe, Hacienda, DGT",
+    "3. Notificación electrónica para el ciudadano/a",
+    "6. Notificaciones",
+    # No sabe / no aplica no puntúan
+    "No sabe",
+    "no sabe porque es una empresa externa",
+    "99. No sé",
+    "No aplica",
+    "4. No tienen este servicio",
+    None,
+    "",
+])
+def test_respuestas_que_no_puntuan(respuesta):
+    assert math.isnan(puntuar_respuesta(respuesta))